@@ -1,64 +1,107 @@
-from ollama import Client
-import re
 import json
+import hashlib
+import importlib
 import logging
+import numpy as np
+from backend import config, llm, metrics
+from backend.cache import ResultCache, make_key, normalize_text
+from backend.executor import cpu_batches, cpu_map
+from backend.keywords import top_keywords
+from backend.parsing import ANALYSIS_SCHEMA, BATCH_SCHEMA, STRING_LIST_SCHEMA, ParseError, parse_analysis, parse_batch, parse_string_list, strip_list_markup
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
 
-client = Client(host='http://localhost:11434')
-
-def translate_to_english(text, language):
-    return text  # Placeholder
-
-def analyze_comment(comment: str):
-    comments = [c.strip() for c in comment.split('\n') if c.strip()]
-    if not comments:
-        return 'Neutral', 50, 'No valid comment provided', []
-
-    sentiments, confidences, summaries, all_keywords = [], [], [], []
-    for single_comment in comments:
-        prompt = f"""
+ANALYSIS_PROMPT = """
         Analyze the following comment and return ONLY a valid JSON object with four fields:
         - sentiment: "Positive", "Negative", or "Neutral"
         - confidence: Integer from 0 to 100
         - summary: A one-sentence summary of the comment
         - keywords: A list of 2-5 keywords
-        Comment: '{single_comment}'
+        Comment: '{comment}'
         Example: {{"sentiment": "Positive", "confidence": 85, "summary": "The comment is positive.", "keywords": ["policy", "excellent"]}}
         """
+PROMPT_VERSION = hashlib.sha256(ANALYSIS_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+BATCH_ANALYSIS_PROMPT = """
+        Analyze each of the {count} comments below (one JSON object per line, with an id) and return ONLY a valid JSON array
+        containing one object per comment with five fields:
+        - id: The id of the comment, copied unchanged
+        - sentiment: "Positive", "Negative", or "Neutral"
+        - confidence: Integer from 0 to 100
+        - summary: A one-sentence summary of the comment
+        - keywords: A list of 2-5 keywords
+        Comments:
+        {comments}
+        Example: [{{"id": 0, "sentiment": "Positive", "confidence": 85, "summary": "The comment is positive.", "keywords": ["policy", "excellent"]}}]
+        """
+BATCH_PROMPT_VERSION = hashlib.sha256(BATCH_ANALYSIS_PROMPT.encode('utf-8')).hexdigest()[:12]
+# Stored with every analysis; rows carrying another version are re-run by backend.reanalysis
+ANALYSIS_VERSION = hashlib.sha256(f'{config.LLM_MODEL}|{PROMPT_VERSION}|{BATCH_PROMPT_VERSION}'.encode('utf-8')).hexdigest()[:12]
+BATCH_ITEM_OVERHEAD_TOKENS = 60  # id wrapper in the prompt plus the JSON object in the answer
+
+# Summaries of the fallback results for comments the LLM could not analyze
+FAILED_SUMMARIES = ('Parsing failed', 'Analysis error')
+
+analysis_cache = ResultCache('analysis')
+
+def _format(schema):
+    # Constrained decoding: Ollama only samples tokens that keep the answer valid for the schema
+    return {'format': schema} if config.LLM_STRUCTURED_OUTPUT else {}
+
+def analysis_failed(analysis):
+    return analysis[2] in FAILED_SUMMARIES
+
+def _analyze_line(single_comment: str):
+    key = make_key(normalize_text(single_comment), config.LLM_MODEL, PROMPT_VERSION)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
+    prompt = ANALYSIS_PROMPT.format(comment=single_comment)
+    for attempt in range(config.LLM_PARSE_RETRIES + 1):
+        response = llm.chat(model=config.LLM_MODEL, messages=[{'role': 'user', 'content': prompt}], **_format(ANALYSIS_SCHEMA))
+        result = response['message']['content'].strip()
+        if metrics.sampled(logger):
+            logger.debug("LLaMA prompt: %s\nresponse: %s", prompt, result)
         try:
-            logger.debug("Sending prompt to LLaMA: %s", prompt)
-            response = client.chat(model='llama3:8b', messages=[{'role': 'user', 'content': prompt}])
-            result = response['message']['content'].strip()
-            logger.debug("LLaMA response: %s", result)
-            json_match = re.search(r'\{.*\}', result, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group())
-                sentiment = data.get('sentiment', 'Neutral')
-                confidence = float(data.get('confidence', 50))  # Ensure float
-                summary = data.get('summary', 'No summary')
-                keywords = data.get('keywords', [])
-                if not isinstance(keywords, list):
-                    keywords = [k.strip() for k in str(keywords).split(',') if k.strip()]
-            else:
-                raise json.JSONDecodeError("No JSON found", result, 0)
-            sentiments.append(sentiment)
-            confidences.append(confidence)
-            summaries.append(summary)
-            all_keywords.extend(keywords)
-        except json.JSONDecodeError as e:
-            logger.warning("JSON decode error: %s", str(e))
-            sentiments.append('Neutral')
-            confidences.append(50.0)
-            summaries.append('Parsing failed')
-            all_keywords.extend([])
-        except Exception as e:
-            logger.error("Error: %s", str(e))
-            sentiments.append('Neutral')
-            confidences.append(50.0)
-            summaries.append('Analysis error')
-            all_keywords.extend([])
+            analysis = parse_analysis(result)
+        except ParseError as e:
+            metrics.record_parse('single', failed=1)
+            logger.warning("Unusable analysis (attempt %d): %s", attempt + 1, str(e))
+            continue
+        metrics.record_parse('single', ok=1)
+        # Only successful parses are cached; failures are retried next time the text is seen
+        analysis_cache.put(key, list(analysis))
+        return analysis
+    raise ParseError(f"No valid analysis after {config.LLM_PARSE_RETRIES + 1} attempts")
+
+def _safe_analyze_line(single_comment: str):
+    try:
+        return _analyze_line(single_comment)
+    except ParseError:
+        return 'Neutral', 50.0, 'Parsing failed', []
+    except Exception as e:
+        logger.error("Error: %s", str(e))
+        return 'Neutral', 50.0, 'Analysis error', []
+
+def _split_lines(comment):
+    return [c.strip() for c in str(comment).split('\n') if c.strip()]
+
+def _aggregate(line_results):
+    if not line_results:
+        return 'Neutral', 50, 'No valid comment provided', []
+    # A line that could not be analyzed must not pull the comment towards Neutral
+    usable = [r for r in line_results if not analysis_failed(r)]
+    if not usable:
+        return line_results[0]
+    line_results = usable
+
+    sentiments, confidences, summaries, all_keywords = [], [], [], []
+    for sentiment, confidence, summary, keywords in line_results:
+        sentiments.append(sentiment)
+        confidences.append(confidence)
+        summaries.append(summary)
+        all_keywords.extend(keywords)
 
     sentiment_counts = {'Positive': 0, 'Negative': 0, 'Neutral': 0}
     for s in sentiments:
@@ -66,11 +109,99 @@ def analyze_comment(comment: str):
     aggregated_sentiment = max(sentiment_counts, key=sentiment_counts.get)
     aggregated_confidence = sum(confidences) / len(confidences) if confidences else 50.0
     aggregated_summary = f"Multiple comments express {'positive' if aggregated_sentiment == 'Positive' else 'negative' if aggregated_sentiment == 'Negative' else 'neutral'} sentiments."
-    keyword_freq = {k: all_keywords.count(k) for k in set(all_keywords)}
-    aggregated_keywords = sorted(keyword_freq, key=keyword_freq.get, reverse=True)[:5]
+    aggregated_keywords = top_keywords(all_keywords, 5)
 
     return aggregated_sentiment, aggregated_confidence, aggregated_summary, aggregated_keywords
 
+def analyze_comment(comment: str):
+    with metrics.stage('analyze', 1):
+        return _aggregate([_safe_analyze_line(c) for c in _split_lines(comment)])
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def _analyze_lines_batched(lines):
+    """Analyze several lines in one prompt; returns {index: result} for the items that parsed."""
+    numbered = '\n'.join(json.dumps({'id': i, 'comment': line}, ensure_ascii=False) for i, line in enumerate(lines))
+    prompt = BATCH_ANALYSIS_PROMPT.format(count=len(lines), comments=numbered)
+    response = llm.chat(model=config.LLM_MODEL, messages=[{'role': 'user', 'content': prompt}], **_format(BATCH_SCHEMA))
+    result = response['message']['content'].strip()
+    if metrics.sampled(logger):
+        logger.debug("LLaMA batch prompt (%d comments): %s\nresponse: %s", len(lines), prompt, result)
+    # Items are validated one by one, so a garbled or truncated item only costs itself
+    parsed, rejected = parse_batch(result, set(range(len(lines))))
+    metrics.record_parse('batch', ok=len(parsed), failed=len(lines) - len(parsed))
+    if rejected or len(parsed) < len(lines):
+        logger.warning("Batch answer: %d of %d items usable, %d rejected", len(parsed), len(lines), rejected)
+    return parsed
+
+def _analyze_batch(lines):
+    if len(lines) == 1:
+        return [_safe_analyze_line(lines[0])]
+    try:
+        parsed = _analyze_lines_batched(lines)
+    except llm.LLMError as e:
+        # The request itself failed after its retries; smaller batches would only fail the same way
+        logger.error("Batch request failed (%d comments): %s", len(lines), str(e))
+        return [('Neutral', 50.0, 'Analysis error', []) for _ in lines]
+    except Exception as e:
+        logger.error("Batch error (%d comments): %s", len(lines), str(e))
+        parsed = {}
+
+    results = [parsed.get(i) for i in range(len(lines))]
+    for i, analysis in parsed.items():
+        analysis_cache.put(make_key(normalize_text(lines[i]), config.LLM_MODEL, BATCH_PROMPT_VERSION), list(analysis))
+
+    # Split the items the model dropped or garbled and retry only those
+    failed = [i for i, r in enumerate(results) if r is None]
+    if failed:
+        half = (len(failed) + 1) // 2
+        for part in (failed[:half], failed[half:]):
+            if part:
+                for i, analysis in zip(part, _analyze_batch([lines[i] for i in part])):
+                    results[i] = analysis
+    return results
+
+def _pack_batches(lines, batch_size, token_budget):
+    batch, tokens = [], 0
+    for line in lines:
+        cost = _estimate_tokens(line) + BATCH_ITEM_OVERHEAD_TOKENS
+        if batch and (len(batch) >= batch_size or tokens + cost > token_budget):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(line)
+        tokens += cost
+    if batch:
+        yield batch
+
+def analyze_comments(comments, batch_size=None, token_budget=None):
+    """Batched counterpart of analyze_comment: one result tuple per input comment."""
+    batch_size = batch_size or config.LLM_BATCH_SIZE
+    token_budget = token_budget or config.LLM_BATCH_TOKEN_BUDGET
+    per_comment = [_split_lines(c) for c in comments]
+
+    line_results = {}
+    pending = []
+    for lines in per_comment:
+        for line in lines:
+            norm = normalize_text(line)
+            if norm in line_results:
+                continue
+            cached = analysis_cache.get_any([make_key(norm, config.LLM_MODEL, BATCH_PROMPT_VERSION),
+                                             make_key(norm, config.LLM_MODEL, PROMPT_VERSION)])
+            if cached is not None:
+                line_results[norm] = tuple(cached)
+            else:
+                line_results[norm] = None
+                pending.append(line)
+
+    with metrics.stage('analyze', len(comments)):
+        for batch in _pack_batches(pending, batch_size, token_budget):
+            for line, analysis in zip(batch, _analyze_batch(batch)):
+                line_results[normalize_text(line)] = analysis
+
+    return [_aggregate([line_results[normalize_text(line)] for line in lines]) for lines in per_comment]
+
 def get_sentiment(comment: str):
     sentiment, confidence, _, _ = analyze_comment(comment)
     return sentiment, confidence
@@ -83,28 +214,73 @@ def get_keywords(comment: str):
     _, _, _, keywords = analyze_comment(comment)
     return keywords
 
+def _ollama_encoder(texts):
+    response = llm.post('/api/embed', {'model': config.EMBED_MODEL, 'input': texts})
+    return response['embeddings']
+
+def _hashing_encoder(texts):
+    # Offline fallback: signed hashed unigrams/bigrams, no model download needed
+    from sklearn.feature_extraction.text import HashingVectorizer
+    vectorizer = HashingVectorizer(n_features=config.EMBED_DIM, ngram_range=(1, 2), alternate_sign=True, norm='l2')
+    return vectorizer.transform(texts).toarray()
+
+EMBED_BACKENDS = {'ollama': _ollama_encoder, 'hashing': _hashing_encoder}
+
+def _get_encoder():
+    name = config.EMBED_BACKEND
+    if ':' in name:
+        # Any local encoder given as "package.module:function" taking a list of texts
+        module_name, func_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), func_name)
+    return EMBED_BACKENDS[name]
+
+def get_embeddings(comments):
+    """L2-normalized float32 matrix, one row per comment, computed in EMBED_BATCH_SIZE batches."""
+    comments = [str(c) for c in comments]
+    if not comments:
+        return np.zeros((0, 0), dtype=np.float32)
+    encoder = _get_encoder()
+    with metrics.stage('embed', len(comments)):
+        if encoder is _hashing_encoder:
+            # Pure CPU work: spread over the process pool when EXECUTOR=process
+            batches = cpu_map(encoder, cpu_batches(comments))
+        else:
+            step = config.EMBED_BATCH_SIZE
+            batches = [encoder(comments[i:i + step]) for i in range(0, len(comments), step)]
+        vectors = np.vstack([np.asarray(b, dtype=np.float32) for b in batches])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
 def get_embedding(comment: str):
-    import numpy as np
-    np.random.seed(abs(hash(comment)) % (10 ** 8))
-    return ','.join(map(str, np.random.rand(128).tolist()))
+    return get_embeddings([comment])[0]
 
 def get_recommendations(negative_comments):
     if not negative_comments:
         return []
-    combined = ' '.join(negative_comments)[:2000]
+    combined = ' '.join(negative_comments)
+    if len(combined) > 2000:
+        # Condense long inputs hierarchically instead of cutting them off
+        from backend.summaries import reduce_texts
+        combined = reduce_texts(negative_comments, 'concerns') or combined[:2000]
     prompt = f"""
     Suggest 1-3 actionable policy recommendations based on: {combined}
     Return ONLY a valid JSON list, e.g., ["Rec 1", "Rec 2"].
     """
     try:
-        response = client.chat(model='llama3:8b', messages=[{'role': 'user', 'content': prompt}])
+        with metrics.stage('recommend', len(negative_comments)):
+            response = llm.chat(model=config.LLM_MODEL, messages=[{'role': 'user', 'content': prompt}],
+                                **_format(STRING_LIST_SCHEMA))
         result = response['message']['content'].strip()
-        logger.debug("Recommendations response: %s", result)
+        if metrics.sampled(logger):
+            logger.debug("Recommendations response: %s", result)
         try:
-            return json.loads(result)[:3] if isinstance(json.loads(result), list) else []
-        except json.JSONDecodeError:
+            recommendations = parse_string_list(result, 3)
+            metrics.record_parse('recommendations', ok=1)
+            return recommendations
+        except ParseError:
             logger.warning("JSON parse failed for recommendations")
-            return [r.strip() for r in result.split('\n') if r.strip()][:3]
+            metrics.record_parse('recommendations', failed=1)
+            return strip_list_markup(result, 3)
     except Exception as e:
         logger.error("Recommendations error: %s", str(e))
         return []
@@ -112,14 +288,10 @@ def get_recommendations(negative_comments):
 def get_overall_summary(summaries):
     if not summaries:
         return "No summaries."
-    combined = ' '.join(summaries)[:2000]
-    prompt = f"""
-    Summarize: {combined}
-    Return ONLY a concise paragraph.
-    """
+    # Map-reduce over every summary within the token budget (see backend.summaries)
+    from backend.summaries import reduce_texts
     try:
-        response = client.chat(model='llama3:8b', messages=[{'role': 'user', 'content': prompt}])
-        return response['message']['content'].strip()
+        return reduce_texts(summaries, 'map') or "Summary generation failed."
     except Exception as e:
         logger.error("Summary error: %s", str(e))
         return "Summary generation failed."
\ No newline at end of file
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from backend import config
+
+logger = logging.getLogger(__name__)
+
+EVICT_EVERY = 1000  # puts between disk eviction passes
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', str(text)).strip().casefold()
+
+
+def make_key(*parts):
+    return hashlib.sha256('\x1f'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache: an in-process LRU backed by a SQLite table shared across processes."""
+
+    def __init__(self, namespace, path=config.LLM_CACHE_PATH,
+                 memory_entries=config.LLM_CACHE_MEMORY_ENTRIES,
+                 max_entries=config.LLM_CACHE_MAX_ENTRIES,
+                 max_age_days=config.LLM_CACHE_MAX_AGE_DAYS):
+        self.namespace = namespace
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+
+    def _db(self):
+        if not self.path:
+            return None
+        # Connections must not cross a fork (multiprocessing workers inherit this object)
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)')
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        # (value, tier) or (None, None); the caller holds the lock and does the counting
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key], 'memory'
+        try:
+            db = self._db()
+            row = None
+            if db is not None:
+                row = db.execute(
+                    'SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?',
+                    (self.namespace, key),
+                ).fetchone()
+            now = time.time()
+            if row and now - row[1] <= self.max_age:
+                db.execute('UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                           (now, self.namespace, key))
+                db.commit()
+                value = json.loads(row[0])
+                self._remember(key, value)
+                return value, 'disk'
+        except sqlite3.Error as e:
+            logger.warning("Cache read failed: %s", str(e))
+        return None, None
+
+    def get(self, key):
+        return self.get_any([key])
+
+    def get_any(self, keys):
+        """The value of the first key that is cached, counted as one hit or one miss."""
+        with self._lock:
+            for key in keys:
+                value, tier = self._lookup(key)
+                if tier is not None:
+                    self.hits[tier] += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            try:
+                db = self._db()
+                if db is None:
+                    return
+                now = time.time()
+                db.execute(
+                    'INSERT OR REPLACE INTO cache (namespace, key, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                    (self.namespace, key, json.dumps(value), now, now),
+                )
+                db.commit()
+                self._puts += 1
+                if self._puts % EVICT_EVERY == 0:
+                    self._evict(db)
+            except sqlite3.Error as e:
+                logger.warning("Cache write failed: %s", str(e))
+
+    def _evict(self, db):
+        db.execute('DELETE FROM cache WHERE namespace = ? AND created_at < ?',
+                   (self.namespace, time.time() - self.max_age))
+        count = db.execute('SELECT COUNT(*) FROM cache WHERE namespace = ?', (self.namespace,)).fetchone()[0]
+        if count > self.max_entries:
+            db.execute("""
+                DELETE FROM cache WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at LIMIT ?
+                )
+            """, (self.namespace, self.namespace, count - self.max_entries))
+        db.commit()
+
+    def evict(self):
+        with self._lock:
+            db = self._db()
+            if db is not None:
+                self._evict(db)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._db()
+            if db is not None:
+                db.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+                db.commit()
+
+    def stats(self):
+        hits = self.hits['memory'] + self.hits['disk']
+        total = hits + self.misses
+        return {
+            'namespace': self.namespace,
+            'memory_hits': self.hits['memory'],
+            'disk_hits': self.hits['disk'],
+            'misses': self.misses,
+            'hit_rate': hits / total if total else 0.0,
+            'memory_entries': len(self._memory),
+        }
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+
+from backend import config
+from backend.db import Session, Comment, ClusterCentroid, bump_data_version
+from backend.executor import cpu_map
+from backend.vectors import pack_embedding, unpack_embedding
+
+logger = logging.getLogger(__name__)
+
+_locks = defaultdict(threading.Lock)  # per draft version
+_scheduler = None
+
+
+def _nearest(vectors, centroids):
+    # argmin ||v - c||^2 == argmax(v.c - |c|^2 / 2)
+    return np.argmax(vectors @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+
+def _unit(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def _seeds(vectors, centroids, needed):
+    """Up to `needed` new centroids from the batch, each with cosine similarity below
+    CLUSTER_SEED_SIMILARITY to the existing centroids and to each other, so comments that
+    arrive one at a time do not each become a topic of their own."""
+    accepted = list(_unit(centroids)) if len(centroids) else []
+    candidates = vectors
+    if accepted:
+        candidates = vectors[(_unit(vectors) @ np.vstack(accepted).T).max(axis=1) < config.CLUSTER_SEED_SIMILARITY]
+    if len(candidates) > needed:
+        candidates, _ = kmeans_plusplus(candidates, n_clusters=needed, random_state=42)
+    seeds = []
+    for vector in candidates:
+        unit = _unit(vector)
+        if not accepted or max(float(unit @ c) for c in accepted) < config.CLUSTER_SEED_SIMILARITY:
+            seeds.append(vector)
+            accepted.append(unit)
+    return seeds
+
+
+def assign_clusters(draft_version, vectors, k=None):
+    """Assign vectors to the draft's persistent centroids in O(k) each and fold them into
+    the running means; missing clusters are seeded from the batch (see _seeds)."""
+    k = k or config.CLUSTER_K
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return []
+    with _locks[draft_version]:
+        db = Session()
+        try:
+            rows = db.query(ClusterCentroid).filter_by(draft_version=draft_version).order_by(ClusterCentroid.cluster).all()
+            if rows and len(unpack_embedding(rows[0].centroid)) != vectors.shape[1]:
+                logger.warning("Embedding size changed for %s; reseeding clusters", draft_version)
+                for row in rows:
+                    db.delete(row)
+                rows = []
+            if len(rows) < k:
+                existing = np.vstack([unpack_embedding(r.centroid) for r in rows]) if rows else []
+                seeds = _seeds(vectors, existing, k - len(rows))
+                next_id = max((r.cluster for r in rows), default=-1) + 1
+                for i, seed in enumerate(seeds):
+                    row = ClusterCentroid(draft_version=draft_version, cluster=next_id + i,
+                                          centroid=pack_embedding(seed), count=0)
+                    db.add(row)
+                    rows.append(row)
+
+            centroids = np.vstack([unpack_embedding(r.centroid) for r in rows])
+            counts = np.array([r.count or 0 for r in rows], dtype=np.float64)
+            nearest = _nearest(vectors, centroids)
+            now = time.time()
+            for j in np.unique(nearest).tolist():
+                members = vectors[nearest == j]
+                total = counts[j] + len(members)
+                centroid = centroids[j] + (members.sum(axis=0) - len(members) * centroids[j]) / total
+                rows[j].centroid = pack_embedding(centroid)
+                rows[j].count = int(total)
+                rows[j].updated_at = now
+            db.commit()
+            return [rows[j].cluster for j in nearest.tolist()]
+        finally:
+            db.close()
+
+
+def _iter_embeddings(db, draft_version, batch_size, dim=None):
+    query = db.query(Comment.id, Comment.embedding).filter(
+        Comment.draft_version == draft_version, Comment.embedding.isnot(None)).order_by(Comment.id)
+    ids, vectors = [], []
+    for comment_id, blob in query.yield_per(batch_size):
+        vector = unpack_embedding(blob)
+        if dim is None:
+            dim = len(vector)
+        elif len(vector) != dim:
+            continue  # embedded by a different backend
+        ids.append(comment_id)
+        vectors.append(vector)
+        if len(ids) >= batch_size:
+            yield ids, np.vstack(vectors)
+            ids, vectors = [], []
+    if ids:
+        yield ids, np.vstack(vectors)
+
+
+def _project(vectors):
+    from sklearn.decomposition import PCA
+    return PCA(n_components=2).fit_transform(vectors)
+
+
+def cluster_points(db, draft_version=None, section=None, limit=5000):
+    """A fixed-seed sample of at most `limit` embedded comments projected to 2-D with PCA, for the
+    topic bubble chart; the embeddings themselves never leave the server."""
+    query = db.query(Comment.id).filter(Comment.embedding.isnot(None))
+    if draft_version:
+        query = query.filter(Comment.draft_version == draft_version)
+    if section:
+        query = query.filter(Comment.section == section)
+    ids = [i for (i,) in query.order_by(Comment.id)]
+    if len(ids) > limit:
+        ids = sorted(np.random.default_rng(42).choice(ids, limit, replace=False).tolist())
+
+    rows, vectors = [], []
+    for start in range(0, len(ids), 500):
+        for row in db.query(Comment.id, Comment.cluster, Comment.confidence, Comment.summary, Comment.embedding).filter(
+                Comment.id.in_(ids[start:start + 500])):
+            vector = unpack_embedding(row.embedding)
+            if vectors and len(vector) != len(vectors[0]):
+                continue  # embedded by a different backend
+            rows.append(row)
+            vectors.append(vector)
+    if len(rows) < 2:
+        return []
+    reduced = cpu_map(_project, [np.vstack(vectors)])[0]
+    return [{'id': r.id, 'cluster': r.cluster, 'confidence': r.confidence, 'summary': r.summary,
+             'x': float(x), 'y': float(y)} for r, (x, y) in zip(rows, reduced)]
+
+
+def recluster(draft_version, k=None, batch_size=5000):
+    """Refit the draft's centroids over its whole corpus in streaming batches, keeping
+    cluster ids stable by matching new centroids to the old ones."""
+    k = k or config.CLUSTER_K
+    started = time.time()
+    db = Session()
+    try:
+        kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=min(batch_size, 1024))
+        dim, pending, total = None, [], 0
+        for _, vectors in _iter_embeddings(db, draft_version, batch_size):
+            dim = vectors.shape[1]
+            pending.append(vectors)
+            total += len(vectors)
+            # partial_fit needs at least k samples in its first batch
+            if sum(len(p) for p in pending) >= max(k, batch_size):
+                kmeans.partial_fit(np.vstack(pending))
+                pending = []
+        if total < k:
+            logger.info("Skipping recluster of %s: %d embedded comments", draft_version, total)
+            return None
+        if pending:
+            kmeans.partial_fit(np.vstack(pending))
+        new_centroids = kmeans.cluster_centers_.astype(np.float32)
+
+        with _locks[draft_version]:
+            old = db.query(ClusterCentroid).filter_by(draft_version=draft_version).all()
+            old = [r for r in old if len(unpack_embedding(r.centroid)) == dim]
+            mapping = {}
+            if old:
+                old_centroids = np.vstack([unpack_embedding(r.centroid) for r in old])
+                cost = ((new_centroids[:, None, :] - old_centroids[None, :, :]) ** 2).sum(axis=2)
+                for new_j, old_j in zip(*linear_sum_assignment(cost)):
+                    mapping[int(new_j)] = old[old_j].cluster
+            next_id = max([r.cluster for r in old] + list(mapping.values()) + [-1]) + 1
+            for j in range(k):
+                if j not in mapping:
+                    mapping[j] = next_id
+                    next_id += 1
+
+        # Writes go through a second session so the streaming read cursor stays open
+        counts = np.zeros(k, dtype=np.int64)
+        writer = Session()
+        try:
+            for ids, vectors in _iter_embeddings(db, draft_version, batch_size, dim):
+                labels = kmeans.predict(vectors)
+                counts += np.bincount(labels, minlength=k)
+                writer.bulk_update_mappings(Comment, [{'id': i, 'cluster': mapping[int(l)]} for i, l in zip(ids, labels)])
+                writer.commit()
+        finally:
+            writer.close()
+
+        with _locks[draft_version]:
+            db.query(ClusterCentroid).filter_by(draft_version=draft_version).delete()
+            now = time.time()
+            for j in range(k):
+                db.add(ClusterCentroid(draft_version=draft_version, cluster=mapping[j],
+                                       centroid=pack_embedding(new_centroids[j]), count=int(counts[j]), updated_at=now))
+            bump_data_version(db, rewrite=True)  # cluster ids of existing comments changed
+            db.commit()
+        logger.info("Reclustered %s: %d comments in %.1fs", draft_version, total, time.time() - started)
+        return {mapping[j]: int(counts[j]) for j in range(k)}
+    except Exception as e:
+        db.rollback()
+        logger.error("Recluster of %s failed: %s", draft_version, str(e))
+        raise
+    finally:
+        db.close()
+
+
+def recluster_all():
+    db = Session()
+    try:
+        drafts = [d for (d,) in db.query(Comment.draft_version).distinct() if d is not None]
+    finally:
+        db.close()
+    for draft_version in drafts:
+        try:
+            recluster(draft_version)
+        except Exception:
+            pass  # already logged; keep going with the other drafts
+
+
+def _run_periodically(interval):
+    while True:
+        time.sleep(interval)
+        recluster_all()
+
+
+def start_scheduler(interval=None):
+    global _scheduler
+    interval = config.RECLUSTER_INTERVAL if interval is None else interval
+    if interval > 0 and _scheduler is None:
+        _scheduler = threading.Thread(target=_run_periodically, args=(interval,), name='recluster', daemon=True)
+        _scheduler.start()
@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float
+import os
+from sqlalchemy import create_engine, event, insert, inspect, select, text, update, BigInteger, Column, Index, Integer, String, Float, LargeBinary
 from sqlalchemy_utils import ScalarListType
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from backend import config
 
 Base = declarative_base()
 
@@ -10,22 +12,231 @@ class Comment(Base):
     id = Column(Integer, primary_key=True)
     original_comment = Column(String)
     translated_comment = Column(String)
-    sentiment = Column(String)
+    sentiment = Column(String, index=True)
     confidence = Column(Float)
     summary = Column(String)
     keywords = Column(ScalarListType())  # Array support
-    section = Column(String)
+    section = Column(String, index=True)
     priority = Column(String, default="Normal")
-    draft_version = Column(String)
-    date = Column(String)
+    draft_version = Column(String, index=True)
+    date = Column(String, index=True)
     stakeholder = Column(String)
-    embedding = Column(ScalarListType())  # Array support
-    cluster = Column(Integer)
+    embedding = Column(LargeBinary)  # packed little-endian float32, see backend.vectors
+    cluster = Column(Integer, index=True)
+    analysis_tier = Column(String, index=True)  # rule, prefilter, duplicate, llm or failed (NULL: analyzed before tiers existed)
+    duplicate_group = Column(Integer, index=True)  # see backend.dedup; the group size lives on duplicate_groups
+    analysis_version = Column(String, index=True)  # model + prompt hash, see backend.ai.ANALYSIS_VERSION
+
+    __table_args__ = (Index('ix_comments_draft_version_section', 'draft_version', 'section'),)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    id = Column(String, primary_key=True)
+    kind = Column(String, default="upload")  # upload, summary, reanalysis
+    filename = Column(String)
+    draft_version = Column(String)  # target of non-upload jobs
+    section = Column(String)  # optional reanalysis scope
+    after_id = Column(Integer)  # reanalysis resume point: rows up to this id were handled
+    path = Column(String)
+    status = Column(String, default="queued")  # queued, running, done, failed
+    rows_total = Column(Integer)
+    rows_done = Column(Integer, default=0)  # resume point: committed together with the chunk's rows
+    chunks_done = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+    error = Column(String)
+    created_at = Column(Float)
+    started_at = Column(Float)
+    started_rows = Column(Integer, default=0)  # rows_done when the current run started, for throughput
+    updated_at = Column(Float)
+    finished_at = Column(Float)
+    trace = Column(String)  # JSON per-stage timings and LLM usage, see backend.metrics.Trace
+
+class ClusterCentroid(Base):
+    __tablename__ = 'cluster_centroids'
+    draft_version = Column(String, primary_key=True)
+    cluster = Column(Integer, primary_key=True)  # stable id, reused across uploads and reclusters
+    centroid = Column(LargeBinary)  # packed float32, like Comment.embedding
+    count = Column(Integer, default=0)
+    updated_at = Column(Float)
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',  # 64 MiB
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA busy_timeout=30000',
+)
+
+def _make_engine(url):
+    if url.startswith('sqlite'):
+        path = url.split('///', 1)[-1]
+        if path and path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        engine = create_engine(url, connect_args={'check_same_thread': False, 'timeout': 30})
+
+        @event.listens_for(engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+            cursor.close()
+        return engine
+    # PostgreSQL and other servers: pooled connections, checked before use
+    return create_engine(url, pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW,
+                         pool_pre_ping=True, pool_recycle=1800)
+
+# Rollups: counts kept up to date as comments are inserted (see backend.rollups)
+class SentimentDateRollup(Base):
+    __tablename__ = 'rollup_sentiment_date'
+    draft_version = Column(String, primary_key=True)
+    section = Column(String, primary_key=True)
+    date = Column(String, primary_key=True)
+    sentiment = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+class KeywordSentimentRollup(Base):
+    __tablename__ = 'rollup_keyword_sentiment'
+    draft_version = Column(String, primary_key=True)
+    section = Column(String, primary_key=True)
+    keyword = Column(String, primary_key=True)
+    sentiment = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+class StakeholderRollup(Base):
+    __tablename__ = 'rollup_stakeholder'
+    draft_version = Column(String, primary_key=True)
+    section = Column(String, primary_key=True)
+    stakeholder = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+    characters = Column(Integer, default=0)
+
+# Map-reduce summaries per draft version (see backend.summaries)
+class DraftSummary(Base):
+    __tablename__ = 'draft_summaries'
+    draft_version = Column(String, primary_key=True)
+    summary = Column(String)
+    recommendations = Column(String)  # JSON list
+    cluster_summaries = Column(String)  # JSON object: cluster (or section) -> summary
+    comments_covered = Column(Integer, default=0)
+    llm_calls = Column(Integer, default=0)  # calls made by the last refresh; the rest came from the cache
+    updated_at = Column(Float)
+
+# Duplicate groups per draft: exact_key is the normalized text hash of the first member,
+# signature its MinHash; buckets are the LSH band hashes pointing at a group
+class DuplicateGroup(Base):
+    __tablename__ = 'duplicate_groups'
+    id = Column(Integer, primary_key=True)
+    draft_version = Column(String)
+    exact_key = Column(String)
+    signature = Column(LargeBinary)  # little-endian uint32 MinHash values
+    size = Column(Integer, default=0)  # stored members, incremented as comments are inserted
+
+    __table_args__ = (Index('ix_duplicate_groups_draft_version_exact_key', 'draft_version', 'exact_key'),)
+
+class DedupBucket(Base):
+    __tablename__ = 'dedup_buckets'
+    draft_version = Column(String, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    group_id = Column(Integer)
 
-engine = create_engine('sqlite:///db/database.db')
+# Keyword inverted index: normalized terms and their posting lists (see backend.keywords)
+class Keyword(Base):
+    __tablename__ = 'keywords'
+    id = Column(Integer, primary_key=True)
+    term = Column(String, nullable=False, unique=True)
+
+class CommentKeyword(Base):
+    __tablename__ = 'comment_keywords'
+    keyword_id = Column(Integer, primary_key=True)  # leading key: postings for a term are contiguous
+    comment_id = Column(Integer, primary_key=True, index=True)
+
+# Data version counters for client caches: data_version moves on every write, rewrite_version
+# only when existing rows change (e.g. a recluster), which invalidates incremental fetches
+class Meta(Base):
+    __tablename__ = 'meta'
+    key = Column(String, primary_key=True)
+    value = Column(Integer, default=0)
+
+META_KEYS = ('data_version', 'rewrite_version')
+
+engine = _make_engine(config.DATABASE_URL)
 Base.metadata.create_all(engine)  # This recreates if table exists
+
+def _ensure_indexes():
+    # create_all only creates indexes together with new tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+def _add_missing_columns():
+    # create_all does not alter existing tables; add columns introduced since they were created
+    existing_tables = inspect(engine).get_table_names()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def _drop_legacy_embeddings():
+    # Embeddings used to be stored as comma-joined decimal text (and were random);
+    # clear them so `python -m backend.vectors backfill` can recompute real ones
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE comments SET embedding = NULL WHERE typeof(embedding) = 'text'"))
+
+def _count_group_members():
+    # Groups created before sizes were kept on the group get counted once
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE duplicate_groups SET size = (SELECT count(*) FROM comments "
+                          "WHERE comments.duplicate_group = duplicate_groups.id) WHERE size IS NULL"))
+
+def _ensure_meta():
+    with engine.begin() as conn:
+        existing = {k for (k,) in conn.execute(select(Meta.key))}
+        for key in META_KEYS:
+            if key not in existing:
+                conn.execute(insert(Meta).values(key=key, value=0))
+
+_add_missing_columns()
+_ensure_indexes()
+_drop_legacy_embeddings()
+_count_group_members()
+_ensure_meta()
 Session = sessionmaker(bind=engine)
 
+COMMENT_COLUMNS = {c.name for c in Comment.__table__.columns}
+
+def comment_values(item):
+    # Pipeline results carry extra keys (e.g. policy_recommendations) that are not columns
+    return {k: v for k, v in item.items() if k in COMMENT_COLUMNS}
+
+def bulk_insert_comments(session, items, batch_size=None):
+    """Insert pipeline results with executemany-style batched INSERTs; returns the new ids in order.
+    The caller owns the transaction."""
+    batch_size = batch_size or config.DB_INSERT_BATCH
+    rows = [comment_values(item) for item in items]
+    ids = []
+    for start in range(0, len(rows), batch_size):
+        result = session.execute(
+            insert(Comment).returning(Comment.id, sort_by_parameter_order=True),
+            rows[start:start + batch_size],
+        )
+        ids.extend(result.scalars().all())
+    return ids
+
+def bump_data_version(session, rewrite=False):
+    """Advance the data version in the caller's transaction; rewrite=True when existing rows changed."""
+    keys = META_KEYS if rewrite else ('data_version',)
+    session.execute(update(Meta).where(Meta.key.in_(keys)).values(value=Meta.value + 1))
+
+def data_versions(session):
+    return {k: v for k, v in session.execute(select(Meta.key, Meta.value))}
+
 def get_db():
     db = Session()
     try:
@@ -0,0 +1,191 @@
+import logging
+import re
+import threading
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend import config
+from backend.cache import make_key, normalize_text
+from backend.db import Session, Comment, DuplicateGroup, DedupBucket
+from backend.executor import cpu_batches, cpu_map
+
+logger = logging.getLogger(__name__)
+
+MIN_SHINGLES = 5  # shorter texts are only matched exactly
+_PRIME = 4294967311  # > 2**32
+_rng = np.random.default_rng(1234)
+_A = _rng.integers(1, 2 ** 31, size=256, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 31, size=256, dtype=np.uint64)
+
+_locks = defaultdict(threading.Lock)  # per draft version
+
+
+def exact_key(comment):
+    # Case, whitespace and punctuation differences still count as the same text
+    return make_key(re.sub(r'[^\w\s]', '', normalize_text(comment)).strip())
+
+
+def shingles(comment, k=3):
+    words = re.findall(r'\w+', normalize_text(comment))
+    grams = {' '.join(words[i:i + k]) for i in range(max(len(words) - k + 1, 0))}
+    return np.array(sorted(zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64)
+
+
+def minhash(hashes, num_perm=None):
+    num_perm = num_perm or config.DEDUP_NUM_PERM
+    if not len(hashes):
+        return None
+    # Universal hashing (a*x + b) mod p for every permutation at once; products stay below 2**63
+    values = (_A[:num_perm, None] * hashes[None, :] + _B[:num_perm, None]) % np.uint64(_PRIME)
+    return values.min(axis=1).astype(np.uint32)
+
+
+def compute_signatures(comments):
+    """MinHash signature per comment, or None for texts too short for near matching."""
+    result = []
+    for comment in comments:
+        hashes = shingles(comment)
+        result.append(minhash(hashes) if len(hashes) >= MIN_SHINGLES else None)
+    return result
+
+
+def _buckets(signature, bands):
+    rows = len(signature) // bands
+    return [(band << 32) | zlib.crc32(signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+
+def _similarity(a, b):
+    return float(np.mean(a == b))
+
+
+def _unpack(blob):
+    return np.frombuffer(blob, dtype='<u4') if blob is not None else None
+
+
+def assign_groups(draft_versions, comments):
+    """Duplicate-group id for each comment: exact matches by normalized hash, near matches by
+    MinHash/LSH over word shingles, checked against the group's first member. Groups persist
+    per draft, so copies arriving in later uploads join the existing campaign.
+    Returns (group ids, ids of the groups that already existed before this call)."""
+    threshold = config.DEDUP_THRESHOLD
+    bands = config.DEDUP_BANDS
+    keys = [exact_key(c) for c in comments]
+    signatures = [s for batch in cpu_map(compute_signatures, cpu_batches(comments)) for s in batch]
+
+    by_draft = defaultdict(list)
+    for i, draft_version in enumerate(draft_versions):
+        by_draft[draft_version].append(i)
+
+    groups = [None] * len(comments)
+    existing = set()
+    for draft_version, indices in by_draft.items():
+        with _locks[draft_version]:
+            db = Session()
+            try:
+                exact = {}
+                wanted = sorted({keys[i] for i in indices})
+                for start in range(0, len(wanted), 500):
+                    exact.update(db.query(DuplicateGroup.exact_key, DuplicateGroup.id).filter(
+                        DuplicateGroup.draft_version == draft_version, DuplicateGroup.exact_key.in_(wanted[start:start + 500])))
+                bucket_groups = {}
+                wanted = {b for i in indices if signatures[i] is not None for b in _buckets(signatures[i], bands)}
+                wanted = sorted(wanted)
+                for start in range(0, len(wanted), 500):
+                    bucket_groups.update(db.query(DedupBucket.bucket, DedupBucket.group_id).filter(
+                        DedupBucket.draft_version == draft_version, DedupBucket.bucket.in_(wanted[start:start + 500])))
+                group_signatures = {}
+                new_buckets = []
+                created = set()
+
+                for i in indices:
+                    if keys[i] in exact:
+                        groups[i] = exact[keys[i]]
+                        continue
+                    signature = signatures[i]
+                    if signature is not None:
+                        buckets = _buckets(signature, bands)
+                        best, best_score = None, threshold
+                        for candidate in {bucket_groups[b] for b in buckets if b in bucket_groups}:
+                            if candidate not in group_signatures:
+                                group_signatures[candidate] = _unpack(db.get(DuplicateGroup, candidate).signature)
+                            reference = group_signatures[candidate]
+                            if reference is not None and len(reference) == len(signature):
+                                score = _similarity(signature, reference)
+                                if score >= best_score:
+                                    best, best_score = candidate, score
+                        if best is not None:
+                            groups[i] = best
+                            continue
+                    group = DuplicateGroup(draft_version=draft_version, exact_key=keys[i],
+                                           signature=signature.astype('<u4').tobytes() if signature is not None else None)
+                    db.add(group)
+                    db.flush()
+                    groups[i] = exact[keys[i]] = group.id
+                    created.add(group.id)
+                    if signature is not None:
+                        group_signatures[group.id] = signature
+                        for b in _buckets(signature, bands):
+                            if b not in bucket_groups:
+                                bucket_groups[b] = group.id
+                                new_buckets.append({'draft_version': draft_version, 'bucket': b, 'group_id': group.id})
+                if new_buckets:
+                    dialect = db.get_bind().dialect.name
+                    if dialect in ('sqlite', 'postgresql'):
+                        stmt = (sqlite if dialect == 'sqlite' else postgresql).insert(DedupBucket.__table__)
+                        db.execute(stmt.on_conflict_do_nothing(index_elements=['draft_version', 'bucket']), new_buckets)
+                    else:
+                        db.bulk_insert_mappings(DedupBucket, new_buckets)
+                db.commit()
+                existing.update(groups[i] for i in indices if groups[i] not in created)
+            finally:
+                db.close()
+    return groups, existing
+
+
+ANALYSIS_FIELDS = ('translated_comment', 'sentiment', 'confidence', 'summary', 'keywords', 'priority', 'analysis_version')
+
+
+def stored_analyses(group_ids):
+    """Analysis of the first stored member of each group, for fanning out to new members."""
+    group_ids = sorted(group_ids)
+    analyses = {}
+    db = Session()
+    try:
+        for start in range(0, len(group_ids), 500):
+            first = db.query(func.min(Comment.id)).filter(
+                Comment.duplicate_group.in_(group_ids[start:start + 500])).group_by(Comment.duplicate_group)
+            for r in db.query(Comment).filter(Comment.id.in_(first)):
+                analyses[r.duplicate_group] = {f: getattr(r, f) for f in ANALYSIS_FIELDS}
+        return analyses
+    finally:
+        db.close()
+
+
+def add_group_members(session, group_ids):
+    """Count newly stored comments into their groups' sizes, in the caller's transaction.
+    One row per group is updated; the member rows themselves are not touched."""
+    added = Counter(g for g in group_ids if g is not None)
+    if added:
+        table = DuplicateGroup.__table__
+        session.execute(
+            update(table).where(table.c.id == bindparam('group')).values(size=func.coalesce(table.c.size, 0) + bindparam('added')),
+            [{'group': group, 'added': n} for group, n in added.items()],
+        )
+
+
+def largest_groups(db, draft_version=None, min_size=2, limit=20):
+    query = db.query(DuplicateGroup.id, DuplicateGroup.size).filter(DuplicateGroup.size >= min_size)
+    if draft_version:
+        query = query.filter(DuplicateGroup.draft_version == draft_version)
+    groups = query.order_by(DuplicateGroup.size.desc()).limit(limit).all()
+    first = db.query(func.min(Comment.id)).filter(Comment.duplicate_group.in_([g for g, _ in groups])).group_by(Comment.duplicate_group)
+    samples = {c.duplicate_group: c for c in db.query(Comment.duplicate_group, Comment.original_comment, Comment.sentiment).filter(
+        Comment.id.in_(first))}
+    return [
+        {"duplicate_group": g, "size": n, "sample_comment": samples[g].original_comment, "sentiment": samples[g].sentiment}
+        for g, n in groups if g in samples
+    ]
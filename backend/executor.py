@@ -0,0 +1,114 @@
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from backend import config
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('thread', 'process', 'serial')
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def default_workers(kind):
+    if config.EXECUTOR_WORKERS > 0 and kind == config.EXECUTOR:
+        return config.EXECUTOR_WORKERS
+    if kind == 'process':
+        return os.cpu_count() or 1
+    # LLM work mostly waits on HTTP: enough threads to keep every server slot busy while
+    # others are parsing results or computing local features
+    return max(config.LLM_CONCURRENCY * 2, 1)
+
+
+def get_executor(kind=None):
+    """Shared executor of the given kind, created once per process and reused across chunks."""
+    kind = kind or config.EXECUTOR
+    if kind not in KINDS:
+        raise ValueError(f"Unknown executor kind: {kind}")
+    if kind == 'serial':
+        return None
+    with _lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            workers = default_workers(kind)
+            if kind == 'process':
+                executor = ProcessPoolExecutor(max_workers=workers)  # CPU stages only, see cpu_map
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline')
+            _executors[kind] = executor
+            logger.info("Started %s executor with %d workers", kind, workers)
+        return executor
+
+
+def io_kind():
+    """Executor kind for LLM-bound work. It always stays in this process, so every request goes
+    through the one LLM client and its adaptive concurrency limit, and metrics and job traces
+    see it; a process pool would give each child its own client and limit."""
+    return 'serial' if config.EXECUTOR == 'serial' else 'thread'
+
+
+def cpu_kind():
+    # CPU-bound stages (MinHash, hashing embeddings, PCA) use processes when EXECUTOR=process and
+    # run in the caller otherwise
+    return 'process' if config.EXECUTOR == 'process' else 'serial'
+
+
+def cpu_map(fn, items):
+    """map_ordered for CPU-bound stages. With processes, fn must be a module-level function and
+    items should be batches large enough to be worth pickling."""
+    return map_ordered(fn, items, kind=cpu_kind())
+
+
+def cpu_batches(items, min_size=200):
+    """Split items, in order, into about one batch per process worker and none smaller than min_size."""
+    step = max(-(-len(items) // default_workers('process')), min_size)
+    return [items[j:j + step] for j in range(0, len(items), step)]
+
+
+def imap_unordered(fn, items, kind=None, max_pending=None):
+    """Yield (index, fn(item)) as results complete, with no barrier between items. At most
+    max_pending calls are outstanding, so a lazy `items` iterator is consumed only as fast as
+    results drain (back-pressure on the producer). The first exception is re-raised."""
+    kind = kind or config.EXECUTOR
+    executor = get_executor(kind)
+    if executor is None:
+        for i, item in enumerate(items):
+            yield i, fn(item)
+        return
+    max_pending = max_pending or default_workers(kind) * 2
+    pending = {}
+    items = iter(enumerate(items))
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    i, item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if kind == 'process':
+                    pending[executor.submit(fn, item)] = i
+                else:
+                    # Threads run in the submitter's context so the current job trace follows the work
+                    pending[executor.submit(contextvars.copy_context().run, fn, item)] = i
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def map_ordered(fn, items, kind=None, max_pending=None):
+    """Like imap_unordered, but returns the results in input order."""
+    results = {}
+    for i, result in imap_unordered(fn, items, kind, max_pending):
+        results[i] = result
+    return [results[i] for i in range(len(results))]
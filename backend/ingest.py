@@ -0,0 +1,91 @@
+import datetime
+import math
+
+import openpyxl
+import pandas as pd
+
+
+def _clean(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _clean_records(records):
+    return [{k: _clean(v) for k, v in r.items()} for r in records]
+
+
+def _skip(chunks, skip_rows):
+    # Skips by parsed rows, not file lines, so blank lines and quoted newlines cannot shift a resume point
+    for chunk in chunks:
+        if skip_rows >= len(chunk):
+            skip_rows -= len(chunk)
+            continue
+        yield chunk[skip_rows:]
+        skip_rows = 0
+
+
+def iter_csv_chunks(path, chunksize):
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        yield _clean_records(chunk.to_dict('records'))
+
+
+def iter_xlsx_chunks(path, chunksize):
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(h) if h is not None else f'column_{i}' for i, h in enumerate(header)]
+        chunk = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            chunk.append(dict(zip(columns, row)))
+            if len(chunk) >= chunksize:
+                yield _clean_records(chunk)
+                chunk = []
+        if chunk:
+            yield _clean_records(chunk)
+    finally:
+        wb.close()
+
+
+def iter_chunks(path, chunksize, skip_rows=0):
+    """Yield lists of row dicts of at most chunksize rows, starting after skip_rows data rows."""
+    if path.endswith('.csv'):
+        chunks = iter_csv_chunks(path, chunksize)
+    elif path.endswith(('.xlsx', '.xlsm')):
+        chunks = iter_xlsx_chunks(path, chunksize)
+    else:
+        # Legacy .xls has no streaming reader; fall back to a full read
+        records = _clean_records(pd.read_excel(path).to_dict('records'))
+        chunks = (records[i:i + chunksize] for i in range(0, len(records), chunksize))
+    return _skip(chunks, skip_rows)
+
+
+def count_rows(path):
+    """Cheap row count for progress reporting (no parsing); None if unknown."""
+    if path.endswith('.csv'):
+        lines = 0
+        last = b'\n'
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            lines += 1
+        return max(lines - 1, 0)
+    if path.endswith(('.xlsx', '.xlsm')):
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            max_row = wb.active.max_row
+        finally:
+            wb.close()
+        return max(max_row - 1, 0) if max_row else None
+    return None
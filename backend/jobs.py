@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+from backend import config, metrics
+from backend.db import Session, Job, bulk_insert_comments, bump_data_version
+from backend.dedup import add_group_members
+from backend.ingest import count_rows, iter_chunks
+from backend.keywords import index_keywords
+from backend.processing import process_records
+from backend.reanalysis import reanalyze_batch, stale_query, throttle
+from backend.rollups import update_rollups
+from backend.summaries import summarize_draft
+from backend.vectors import index_comments
+
+logger = logging.getLogger(__name__)
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+metrics.Gauge('civicpulse_job_queue_depth', 'Jobs waiting for the background worker', lambda: _queue.qsize())
+
+
+def create_upload_job(filename, fileobj):
+    job_id = uuid.uuid4().hex
+    os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(config.UPLOAD_DIR, job_id + os.path.splitext(filename)[1].lower())
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(fileobj, out)
+
+    db = Session()
+    try:
+        db.add(Job(id=job_id, kind='upload', filename=filename, path=path, status='queued',
+                   rows_done=0, chunks_done=0, failures=0, created_at=time.time()))
+        db.commit()
+    finally:
+        db.close()
+    _queue.put(job_id)
+    return job_id
+
+
+def create_summary_job(draft_version):
+    db = Session()
+    try:
+        # One pending refresh per draft is enough; it reads whatever is committed when it runs
+        pending = db.query(Job).filter_by(kind='summary', draft_version=draft_version, status='queued').first()
+        if pending is not None:
+            return pending.id
+        job_id = uuid.uuid4().hex
+        db.add(Job(id=job_id, kind='summary', draft_version=draft_version, status='queued',
+                   rows_done=0, chunks_done=0, failures=0, created_at=time.time()))
+        db.commit()
+    finally:
+        db.close()
+    _queue.put(job_id)
+    return job_id
+
+
+def create_reanalysis_job(draft_version=None, section=None):
+    db = Session()
+    try:
+        # A queued or running re-run with the same scope will pick up every stale row anyway
+        pending = db.query(Job).filter(Job.kind == 'reanalysis', Job.status.in_(['queued', 'running']),
+                                       Job.draft_version.is_(None) if draft_version is None else Job.draft_version == draft_version,
+                                       Job.section.is_(None) if section is None else Job.section == section).first()
+        if pending is not None:
+            return pending.id
+        job_id = uuid.uuid4().hex
+        db.add(Job(id=job_id, kind='reanalysis', draft_version=draft_version, section=section, status='queued',
+                   rows_done=0, chunks_done=0, failures=0, after_id=0, created_at=time.time()))
+        db.commit()
+    finally:
+        db.close()
+    _queue.put(job_id)
+    return job_id
+
+
+def run_reanalysis_job(job_id):
+    db = Session()
+    try:
+        job = db.get(Job, job_id)
+        if job is None or job.status == 'done':
+            return
+        if job.rows_total is None:
+            job.rows_total = stale_query(db, job.draft_version, job.section).count()
+            job.started_at = time.time()
+            job.started_rows = job.rows_done
+        job.status = 'running'
+        db.commit()
+        drafts = set()
+        while True:
+            started = time.time()
+            updated, job.after_id, touched = reanalyze_batch(db, job.draft_version, job.section, job.after_id or 0)
+            if not updated:
+                break
+            drafts.update(touched)
+            job.rows_done += updated
+            job.chunks_done += 1
+            job.updated_at = time.time()
+            job.trace = metrics.trace_json()
+            db.commit()
+            throttle(updated, started)
+            if not _queue.empty():
+                # Uploads and summaries go first; the re-run continues from after_id when its turn comes
+                job.status = 'queued'
+                db.commit()
+                _queue.put(job_id)
+                break
+        if job.status == 'running':
+            job.status = 'done'
+            job.finished_at = time.time()
+            job.trace = metrics.trace_json()
+            db.commit()
+        for draft_version in sorted(drafts, key=str):
+            create_summary_job(draft_version)
+    except Exception as e:
+        db.rollback()
+        logger.error("Re-analysis job %s failed: %s", job_id, str(e))
+        job = db.get(Job, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = time.time()
+            db.commit()
+    finally:
+        db.close()
+
+
+def run_summary_job(job_id):
+    db = Session()
+    try:
+        job = db.get(Job, job_id)
+        if job is None or job.status == 'done':
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        db.commit()
+        result = summarize_draft(job.draft_version)
+        job.status = 'done'
+        job.rows_total = job.rows_done = result['comments_covered']
+        job.finished_at = time.time()
+        job.trace = metrics.trace_json()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Summary job %s failed: %s", job_id, str(e))
+        job = db.get(Job, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = time.time()
+            db.commit()
+    finally:
+        db.close()
+
+
+def run_upload_job(job_id):
+    db = Session()
+    try:
+        job = db.get(Job, job_id)
+        if job is None or job.status == 'done':
+            return
+        chunk_size = config.JOB_CHUNK_SIZE
+        job.status = 'running'
+        job.rows_total = count_rows(job.path)
+        job.started_at = time.time()
+        job.started_rows = job.rows_done
+        db.commit()
+
+        # Rows before rows_done were committed by an earlier run; chunks stream
+        # from the file so memory stays bounded by the chunk size
+        drafts = set()
+        for chunk in iter_chunks(job.path, chunk_size, skip_rows=job.rows_done):
+            added = []
+            try:
+                processed = process_records(chunk)
+                with metrics.stage('db_insert', len(processed)):
+                    ids = bulk_insert_comments(db, processed)
+                    update_rollups(db, processed)
+                    index_keywords(db, [(i, item['keywords']) for i, item in zip(ids, processed)])
+                    add_group_members(db, [item.get('duplicate_group') for item in processed])
+                    bump_data_version(db)
+                added = [(i, item['draft_version'], item.get('embedding')) for i, item in zip(ids, processed)]
+                drafts.update(item['draft_version'] for item in processed)
+            except Exception as e:
+                db.rollback()
+                logger.error("Job %s chunk %d failed: %s", job_id, job.chunks_done, str(e))
+                job.failures += len(chunk)
+                job.error = str(e)
+            job.rows_done += len(chunk)
+            job.chunks_done += 1
+            job.updated_at = time.time()
+            job.trace = metrics.trace_json()
+            with metrics.stage('db_commit', len(chunk)):
+                db.commit()  # rows and progress land in the same transaction
+            index_comments(added)
+            logger.debug("Job %s: %d/%d rows", job_id, job.rows_done, job.rows_total)
+
+        job.status = 'done'
+        job.rows_total = job.rows_done  # the pre-count is approximate for CSVs with quoted newlines
+        job.finished_at = time.time()
+        job.trace = metrics.trace_json()
+        db.commit()
+        os.remove(job.path)
+        for draft_version in sorted(drafts, key=str):
+            create_summary_job(draft_version)
+    except Exception as e:
+        db.rollback()
+        logger.error("Job %s failed: %s", job_id, str(e))
+        job = db.get(Job, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = time.time()
+            db.commit()
+    finally:
+        db.close()
+
+
+JOB_RUNNERS = {'upload': run_upload_job, 'summary': run_summary_job, 'reanalysis': run_reanalysis_job}
+
+
+def _mark_failed(job_id, error):
+    db = Session()
+    try:
+        job = db.get(Job, job_id)
+        if job is not None and job.status in ('queued', 'running'):
+            job.status = 'failed'
+            job.error = error
+            job.finished_at = time.time()
+            db.commit()
+    except Exception as e:
+        logger.error("Could not mark job %s as failed: %s", job_id, str(e))
+    finally:
+        db.close()
+
+
+def _work():
+    while True:
+        job_id = _queue.get()
+        try:
+            db = Session()
+            try:
+                job = db.get(Job, job_id)
+                kind = job.kind if job is not None else None
+            finally:
+                db.close()
+            if kind in JOB_RUNNERS:
+                with metrics.tracing(metrics.Trace() if config.JOB_TRACE else None):
+                    JOB_RUNNERS[kind](job_id)
+        except Exception as e:
+            # Anything a runner did not handle (e.g. "database is locked" in its own error
+            # path) must not kill the only worker and strand every job queued behind it
+            logger.error("Job %s crashed: %s", job_id, str(e))
+            _mark_failed(job_id, str(e))
+        finally:
+            _queue.task_done()
+
+
+def start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name='upload-jobs', daemon=True)
+            _worker.start()
+
+
+def resume_pending():
+    # Jobs interrupted by a restart pick up from their last committed chunk
+    db = Session()
+    try:
+        pending = db.query(Job).filter(Job.status.in_(['queued', 'running'])).order_by(Job.created_at).all()
+        for job in pending:
+            logger.info("Resuming job %s at row %d", job.id, job.rows_done)
+            _queue.put(job.id)
+        return len(pending)
+    finally:
+        db.close()
+
+
+def job_status(job):
+    now = time.time()
+    throughput = None
+    eta = None
+    if job.started_at:
+        elapsed = (job.finished_at or now) - job.started_at
+        done_this_run = job.rows_done - (job.started_rows or 0)
+        if elapsed > 0 and done_this_run > 0:
+            throughput = done_this_run / elapsed
+            if job.rows_total is not None and job.status == 'running':
+                eta = (job.rows_total - job.rows_done) / throughput
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "filename": job.filename,
+        "draft_version": job.draft_version,
+        "section": job.section,
+        "status": job.status,
+        "rows_total": job.rows_total,
+        "rows_done": job.rows_done,
+        "failures": job.failures,
+        "error": job.error,
+        "rows_per_second": throughput,
+        "eta_seconds": eta,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+        "trace": json.loads(job.trace) if job.trace else None,
+    }
@@ -0,0 +1,153 @@
+import logging
+import re
+import sys
+from collections import Counter
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.db import Session, Comment, Keyword, CommentKeyword, KeywordSentimentRollup
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w\s-]+")
+_SPACES = re.compile(r"[\s_-]+")
+
+
+def _singular(word):
+    # Light plural folding; enough to merge "fees"/"fee" and "policies"/"policy"
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('ches', 'shes', 'sses', 'xes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize_keyword(keyword):
+    words = _SPACES.split(_NON_WORD.sub(' ', str(keyword).casefold()).strip())
+    return ' '.join(_singular(w) for w in words if w)
+
+
+def normalize_keywords(keywords):
+    """Case-folded, singularized, de-duplicated keywords in their original order."""
+    return list(dict.fromkeys(k for k in map(normalize_keyword, keywords or []) if k))
+
+
+def top_keywords(keywords, n=5):
+    """The n most frequent normalized keywords, counted in one pass."""
+    return [k for k, _ in Counter(k for k in map(normalize_keyword, keywords or []) if k).most_common(n)]
+
+
+def _keyword_ids(session, terms):
+    terms = sorted(set(terms))
+    if not terms:
+        return {}
+    table = Keyword.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        stmt = (sqlite if dialect == 'sqlite' else postgresql).insert(table).on_conflict_do_nothing(index_elements=['term'])
+        session.execute(stmt, [{'term': t} for t in terms])
+    else:
+        existing = {t for (t,) in session.query(Keyword.term).filter(Keyword.term.in_(terms))}
+        session.add_all([Keyword(term=t) for t in terms if t not in existing])
+        session.flush()
+    ids = {}
+    for start in range(0, len(terms), 500):
+        chunk = terms[start:start + 500]
+        ids.update(session.query(Keyword.term, Keyword.id).filter(Keyword.term.in_(chunk)))
+    return ids
+
+
+def index_keywords(session, rows):
+    """Add (comment_id, keywords) rows to the inverted index in the caller's transaction."""
+    rows = [(comment_id, normalize_keywords(kws)) for comment_id, kws in rows]
+    ids = _keyword_ids(session, [t for _, terms in rows for t in terms])
+    postings = [{'keyword_id': ids[t], 'comment_id': comment_id} for comment_id, terms in rows for t in terms]
+    if postings:
+        session.execute(CommentKeyword.__table__.insert(), postings)
+
+
+def unindex_keywords(session, comment_ids):
+    """Drop the postings of comments whose keywords are about to change, in the caller's transaction."""
+    comment_ids = sorted(comment_ids)
+    for start in range(0, len(comment_ids), 500):
+        session.query(CommentKeyword).filter(CommentKeyword.comment_id.in_(comment_ids[start:start + 500])).delete(
+            synchronize_session=False)
+
+
+def rebuild_keyword_index(batch_size=5000):
+    reader, writer = Session(), Session()
+    total = 0
+    try:
+        writer.query(CommentKeyword).delete()
+        batch = []
+        for comment_id, kws in reader.query(Comment.id, Comment.keywords).yield_per(batch_size):
+            batch.append((comment_id, kws))
+            if len(batch) >= batch_size:
+                index_keywords(writer, batch)
+                total += len(batch)
+                batch = []
+        index_keywords(writer, batch)
+        writer.commit()
+        return total + len(batch)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def ensure_keyword_index():
+    db = Session()
+    try:
+        missing = db.query(CommentKeyword).first() is None and db.query(Comment.id).filter(
+            Comment.keywords.isnot(None), Comment.keywords != '').first() is not None
+    finally:
+        db.close()
+    if missing:
+        logger.info("Building keyword index from existing comments")
+        rebuild_keyword_index()
+
+
+def _comment_ids(db, term, draft_version=None, section=None, sentiment=None, limit=100):
+    query = db.query(CommentKeyword.comment_id).join(Keyword, Keyword.id == CommentKeyword.keyword_id)
+    query = query.filter(Keyword.term == term)
+    if draft_version or section or sentiment:
+        query = query.join(Comment, Comment.id == CommentKeyword.comment_id)
+        if draft_version:
+            query = query.filter(Comment.draft_version == draft_version)
+        if section:
+            query = query.filter(Comment.section == section)
+        if sentiment:
+            query = query.filter(Comment.sentiment == sentiment)
+    return [i for (i,) in query.order_by(CommentKeyword.comment_id).limit(limit)]
+
+
+def search_keywords(db, draft_version=None, section=None, sentiment=None, q=None, limit=20, ids_limit=100):
+    """Top keywords by comment count from the keyword rollup, each with the ids of matching
+    comments read from the inverted index."""
+    M = KeywordSentimentRollup
+    total = func.sum(M.count)
+    query = db.query(M.keyword, total)
+    if draft_version:
+        query = query.filter(M.draft_version == draft_version)
+    if section:
+        query = query.filter(M.section == section)
+    if sentiment:
+        query = query.filter(M.sentiment == sentiment)
+    if q:
+        prefix = normalize_keyword(q)
+        query = query.filter(M.keyword >= prefix, M.keyword < prefix + '\U0010ffff')
+    query = query.group_by(M.keyword).having(total > 0).order_by(total.desc(), M.keyword).limit(limit)
+    return [
+        {"keyword": k, "count": int(n),
+         "comment_ids": _comment_ids(db, k, draft_version, section, sentiment, ids_limit) if ids_limit else []}
+        for k, n in query
+    ]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['rebuild']:
+        print(f"Indexed keywords of {rebuild_keyword_index()} comments")
+    else:
+        print("Usage: python -m backend.keywords rebuild")
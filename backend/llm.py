@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from backend import config, metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    pass
+
+
+class AdaptiveLimit:
+    """Concurrency limit that adapts to the server (AIMD): it grows by one slot per `limit`
+    successes up to `maximum`, and halves when the server times out or reports overload."""
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < max(int(self.limit), 1))
+            self.in_flight += 1
+
+    async def release(self, overloaded=False):
+        async with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.limit / 2, 1.0)
+            else:
+                self.limit = min(self.limit + 1 / self.limit, float(self.maximum))
+            self._condition.notify_all()
+
+
+OVERLOAD_STATUS = {429, 503, 504}
+
+
+class AsyncLLMClient:
+    """Pooled async client for the Ollama HTTP API with bounded concurrency, timeouts and retries."""
+
+    def __init__(self, host=None, concurrency=None, timeout=None, retries=None, backoff=None):
+        self.host = host or config.OLLAMA_HOST
+        self.concurrency = concurrency or config.LLM_CONCURRENCY
+        self.timeout = timeout or config.LLM_TIMEOUT
+        self.retries = config.LLM_RETRIES if retries is None else retries
+        self.backoff = config.LLM_BACKOFF if backoff is None else backoff
+        self._http = None
+        self._limit = None
+
+    def _ensure_open(self):
+        # Created lazily so both are bound to the loop that first uses the client
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.host,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+            self._limit = AdaptiveLimit(self.concurrency)
+
+    @property
+    def current_limit(self):
+        return int(self._limit.limit) if self._limit is not None else self.concurrency
+
+    async def post(self, path, payload):
+        self._ensure_open()
+        for attempt in range(self.retries + 1):
+            # The slot is held for the request only, not while backing off
+            await self._limit.acquire()
+            overloaded = False
+            outcome, result = 'error', None
+            started = time.perf_counter()
+            try:
+                response = await self._http.post(path, json=payload)
+                if response.status_code in RETRY_STATUS:
+                    overloaded = response.status_code in OVERLOAD_STATUS
+                    raise LLMError(f"{path} returned HTTP {response.status_code}")
+                response.raise_for_status()
+                result = response.json()
+                outcome = 'ok'
+                return result
+            except httpx.HTTPStatusError as e:
+                # Not retried: a missing model or a bad request fails the same way every time
+                raise LLMError(f"{path} returned HTTP {e.response.status_code}") from e
+            except (httpx.TimeoutException, httpx.TransportError, LLMError) as e:
+                overloaded = overloaded or isinstance(e, httpx.TimeoutException)
+                if attempt == self.retries:
+                    raise LLMError(f"{path} failed after {attempt + 1} attempts: {e}") from e
+                outcome = 'retry'
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                logger.warning("LLM request failed (%s), retrying in %.2fs", str(e), delay)
+            finally:
+                metrics.record_llm(path, time.perf_counter() - started, outcome, result)
+                await self._limit.release(overloaded)
+            await asyncio.sleep(delay)
+
+    async def chat(self, messages, model=None, **kwargs):
+        payload = {'model': model or config.LLM_MODEL, 'messages': messages, 'stream': False}
+        payload.update(kwargs)
+        return await self.post('/api/chat', payload)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+# One client and event loop per process, run on a background thread so that sync
+# callers (worker pools) and async endpoints share the same pool and concurrency limit.
+_loop = None
+_client = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop, _client, _pid
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='llm-client', daemon=True).start()
+            _client = AsyncLLMClient()
+            _pid = os.getpid()
+        return _loop
+
+
+def get_client():
+    _get_loop()
+    return _client
+
+
+async def _traced(trace, coro):
+    # Tasks run in a copy of the loop thread's context; carry the caller's job trace over
+    with metrics.tracing(trace):
+        return await coro
+
+
+def _submit(coro_fn, *args, **kwargs):
+    loop = _get_loop()
+    return asyncio.run_coroutine_threadsafe(_traced(metrics.current_trace(), coro_fn(_client, *args, **kwargs)), loop)
+
+
+def _in_flight():
+    return _client._limit.in_flight if _client is not None and _client._limit is not None else 0
+
+
+metrics.Gauge('civicpulse_llm_in_flight', 'LLM requests currently in flight', _in_flight)
+metrics.Gauge('civicpulse_llm_concurrency_limit', 'Current adaptive LLM concurrency limit',
+              lambda: _client.current_limit if _client is not None else config.LLM_CONCURRENCY)
+
+
+def chat(messages, model=None, **kwargs):
+    return _submit(AsyncLLMClient.chat, messages, model=model, **kwargs).result()
+
+
+def chat_many(message_lists, model=None, **kwargs):
+    """Run several chats concurrently on the shared client (still bounded by LLM_CONCURRENCY).
+    Results come back in order; a failed call yields its exception instead of raising."""
+    futures = [_submit(AsyncLLMClient.chat, messages, model=model, **kwargs) for messages in message_lists]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+async def achat(messages, model=None, **kwargs):
+    return await asyncio.wrap_future(_submit(AsyncLLMClient.chat, messages, model=model, **kwargs))
+
+
+def post(path, payload):
+    return _submit(AsyncLLMClient.post, path, payload).result()
+
+
+async def apost(path, payload):
+    return await asyncio.wrap_future(_submit(AsyncLLMClient.post, path, payload))
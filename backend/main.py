@@ -1,44 +1,90 @@
-from fastapi import FastAPI, UploadFile, File, Depends
-from backend.processing import process_comments_batch, process_single_comment
-import pandas as pd
-from backend.db import get_db, Comment
+from fastapi import FastAPI, UploadFile, File, Depends, BackgroundTasks, Request
+from backend.processing import process_single_comment
+from backend import clustering, config, dedup, jobs, keywords, metrics, prefilter, queries, reanalysis, reports, rollups, summaries, vectors
+from backend.db import get_db, Session as SessionLocal, Comment, Job, ClusterCentroid, DraftSummary, bump_data_version, comment_values, data_versions
+from backend.ai import analysis_cache
 from sqlalchemy.orm import Session
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import logging
+import os
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=config.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+if config.LOG_LEVEL != "DEBUG":
+    # httpx logs every LLM request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# Read endpoints whose responses only change when the data version does
+VERSIONED_PATHS = ("/comments", "/analytics", "/keywords", "/clusters", "/duplicate-groups", "/near-duplicates", "/summary", "/version")
+
+
+def _data_etag():
+    db = SessionLocal()
+    try:
+        versions = data_versions(db)
+    finally:
+        db.close()
+    return f'W/"{versions["data_version"]}-{versions["rewrite_version"]}"'
+
+
+@app.middleware("http")
+async def data_version_etag(request: Request, call_next):
+    if request.method != "GET" or not request.url.path.startswith(VERSIONED_PATHS):
+        return await call_next(request)
+    etag = await run_in_threadpool(_data_etag)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+    return response
+
+
+@app.on_event("startup")
+def start_job_worker():
+    rollups.ensure_rollups()
+    keywords.ensure_keyword_index()
+    clustering.start_scheduler()
+    jobs.start_worker()
+    resumed = jobs.resume_pending()
+    if resumed:
+        logger.info("Resumed %d pending upload jobs", resumed)
+
 
 @app.post("/upload")
 @app.post("/upload/")  # ✅ allow both with and without slash
 async def upload_comments(file: UploadFile = File(...)):
     logger.debug("Received file upload: %s", file.filename)
     try:
-        if file.filename.endswith(".csv"):
-            df = pd.read_csv(file.file)
-        else:
-            df = pd.read_excel(file.file)
-
-        logger.debug("File read successfully, rows: %d", len(df))
-        processed_data = process_comments_batch(df)
-        logger.debug("Processed %d comments", len(processed_data))
-
-        db: Session = next(get_db())
-        for item in processed_data:
-            comment = Comment(**item)
-            db.add(comment)
-        db.commit()
-        logger.debug("Data committed to database")
-
-        return {"status": "processed", "count": len(processed_data)}
+        job_id = await run_in_threadpool(jobs.create_upload_job, file.filename, file.file)
+        logger.debug("Queued upload job %s", job_id)
+
+        return {"status": "queued", "job_id": job_id}
     except Exception as e:
         logger.error("Error processing upload: %s", str(e))
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.get("/jobs")
+@app.get("/jobs/")
+def list_jobs(limit: int = 20, db: Session = Depends(get_db)):
+    recent = db.query(Job).order_by(Job.created_at.desc()).limit(limit).all()
+    return [jobs.job_status(job) for job in recent]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(Job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return jobs.job_status(job)
+
+
 @app.post("/analyze")
 @app.post("/analyze/")  # ✅ allow both
 async def analyze_text(data: dict, db: Session = Depends(get_db)):
@@ -49,7 +95,8 @@ async def analyze_text(data: dict, db: Session = Depends(get_db)):
         if not comment:
             return JSONResponse(status_code=400, content={"error": "Comment is required"})
 
-        processed_data = process_single_comment(
+        processed_data = await run_in_threadpool(
+            process_single_comment,
             comment=comment,
             language=language,
             section=data.get("section", "Unknown"),
@@ -59,9 +106,16 @@ async def analyze_text(data: dict, db: Session = Depends(get_db)):
         )
         logger.debug("Processed single comment: %s", processed_data)
 
-        comment_obj = Comment(**processed_data)
-        db.add(comment_obj)
-        db.commit()
+        with metrics.stage("db_commit", 1):
+            comment_obj = Comment(**comment_values(processed_data))
+            db.add(comment_obj)
+            db.flush()
+            rollups.update_rollups(db, [processed_data])
+            keywords.index_keywords(db, [(comment_obj.id, processed_data["keywords"])])
+            dedup.add_group_members(db, [comment_obj.duplicate_group])
+            bump_data_version(db)
+            db.commit()
+        vectors.index_comments([(comment_obj.id, comment_obj.draft_version, comment_obj.embedding)])
 
         return {
             "sentiment": processed_data["sentiment"],
@@ -77,21 +131,193 @@ async def analyze_text(data: dict, db: Session = Depends(get_db)):
 
 @app.get("/comments")
 @app.get("/comments/")  # ✅ allow both
-def get_analysis(draft_version: str = None, section: str = None, db: Session = Depends(get_db)):
+def get_analysis(draft_version: str = None, section: str = None, keyword: str = None, sentiment: str = None,
+                 fields: str = None, include_embedding: bool = False, after_id: int = None, limit: int = None,
+                 format: str = "json", db: Session = Depends(get_db)):
     logger.debug("Received analysis request: draft_version=%s, section=%s", draft_version, section)
     try:
-        query = db.query(Comment)
-        if draft_version:
-            query = query.filter(Comment.draft_version == draft_version)
-        if section:
-            query = query.filter(Comment.section == section)
+        try:
+            selected = queries.parse_fields(fields, include_embedding)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        filters = {"draft_version": draft_version, "section": section, "keyword": keyword, "sentiment": sentiment,
+                   "after_id": after_id}
 
-        results = [c.__dict__ for c in query.all()]
-        for r in results:
-            r.pop("_sa_instance_state", None)
+        if format in ("ndjson", "arrow"):
+            # Whole result set, streamed from a server-side cursor; limit is optional here
+            rows = queries.iter_rows(selected, limit=limit, **filters)
+            if format == "ndjson":
+                return StreamingResponse(queries.iter_ndjson(rows), media_type="application/x-ndjson")
+            if not queries.HAS_PYARROW:
+                return JSONResponse(status_code=501, content={"error": "pyarrow is not installed"})
+            return StreamingResponse(queries.iter_arrow_stream(rows, selected),
+                                     media_type="application/vnd.apache.arrow.stream")
 
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+        results, next_after = queries.fetch_page(db, selected, limit, **filters)
+        headers = {"X-Next-After": str(next_after)} if next_after is not None else {}
         logger.debug("Returning %d results", len(results))
-        return JSONResponse(content=results)
+        if format == "parquet":
+            if not queries.HAS_PYARROW:
+                return JSONResponse(status_code=501, content={"error": "pyarrow is not installed"})
+            return Response(queries.parquet_bytes(results, selected), media_type="application/vnd.apache.parquet",
+                            headers=headers)
+        if format != "json":
+            return JSONResponse(status_code=400, content={"error": f"Unknown format: {format}"})
+        return JSONResponse(content=results, headers=headers)
     except Exception as e:
         logger.error("Error in analysis endpoint: %s", str(e))
         return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@app.get("/comments/{comment_id}/similar")
+def similar_comments(comment_id: int, k: int = 10, db: Session = Depends(get_db)):
+    comment = db.get(Comment, comment_id)
+    if comment is None or comment.embedding is None:
+        return JSONResponse(status_code=404, content={"error": "Comment not found or not embedded"})
+    index = vectors.get_index(comment.draft_version)
+    hits = index.search(vectors.unpack_embedding(comment.embedding), k=k, exclude=comment_id)
+    rows = {c.id: c for c in db.query(Comment.id, Comment.original_comment, Comment.sentiment, Comment.section)
+            .filter(Comment.id.in_([i for i, _ in hits]))}
+    return [
+        {"id": i, "score": score, "original_comment": rows[i].original_comment,
+         "sentiment": rows[i].sentiment, "section": rows[i].section}
+        for i, score in hits if i in rows
+    ]
+
+
+@app.get("/near-duplicates")
+def near_duplicates(draft_version: str, threshold: float = 0.95, limit: int = 100):
+    pairs = vectors.get_index(draft_version).near_duplicates(threshold)[:limit]
+    return [{"id_a": a, "id_b": b, "score": score} for a, b, score in pairs]
+
+
+@app.get("/duplicate-groups")
+def duplicate_groups(draft_version: str = None, min_size: int = 2, limit: int = 20, db: Session = Depends(get_db)):
+    return dedup.largest_groups(db, draft_version, min_size, limit)
+
+
+@app.get("/clusters")
+@app.get("/clusters/")
+def list_clusters(draft_version: str, db: Session = Depends(get_db)):
+    rows = db.query(ClusterCentroid).filter_by(draft_version=draft_version).order_by(ClusterCentroid.cluster).all()
+    return [{"cluster": r.cluster, "count": r.count, "updated_at": r.updated_at} for r in rows]
+
+
+@app.get("/clusters/points")
+def cluster_points(draft_version: str = None, section: str = None, limit: int = 5000, db: Session = Depends(get_db)):
+    try:
+        return clustering.cluster_points(db, draft_version, section, max(1, min(limit, MAX_PAGE_SIZE)))
+    except Exception as e:
+        logger.error("Error in cluster points endpoint: %s", str(e))
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@app.post("/clusters/{draft_version}/recluster")
+def recluster_draft(draft_version: str, background_tasks: BackgroundTasks):
+    background_tasks.add_task(clustering.recluster, draft_version)
+    return {"status": "scheduled", "draft_version": draft_version}
+
+
+@app.get("/analytics/sentiment")
+def analytics_sentiment(draft_version: str = None, section: str = None, db: Session = Depends(get_db)):
+    return rollups.sentiment_totals(db, draft_version, section)
+
+
+@app.get("/analytics/sentiment-by-date")
+def analytics_sentiment_by_date(draft_version: str = None, section: str = None, db: Session = Depends(get_db)):
+    return rollups.sentiment_by_date(db, draft_version, section)
+
+
+@app.get("/analytics/sentiment-by-section")
+def analytics_sentiment_by_section(draft_version: str = None, section: str = None, db: Session = Depends(get_db)):
+    return rollups.sentiment_by_section(db, draft_version, section)
+
+
+@app.get("/analytics/keyword-sentiment")
+def analytics_keyword_sentiment(draft_version: str = None, section: str = None, limit: int = 20,
+                                db: Session = Depends(get_db)):
+    return rollups.keyword_sentiment(db, draft_version, section, limit)
+
+
+@app.get("/analytics/top-stakeholders")
+def analytics_top_stakeholders(draft_version: str = None, section: str = None, limit: int = 5,
+                               db: Session = Depends(get_db)):
+    return rollups.top_stakeholders(db, draft_version, section, limit)
+
+
+@app.get("/keywords")
+@app.get("/keywords/")
+def search_keywords(draft_version: str = None, section: str = None, sentiment: str = None, q: str = None,
+                    limit: int = 20, ids_limit: int = 100, db: Session = Depends(get_db)):
+    try:
+        return keywords.search_keywords(db, draft_version, section, sentiment, q, limit, ids_limit)
+    except Exception as e:
+        logger.error("Error in keyword search: %s", str(e))
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@app.get("/reanalysis")
+@app.get("/reanalysis/")
+def reanalysis_status(draft_version: str = None, db: Session = Depends(get_db)):
+    return reanalysis.status(db, draft_version)
+
+
+@app.post("/reanalysis")
+@app.post("/reanalysis/")
+def start_reanalysis(draft_version: str = None, section: str = None):
+    # Rows keep serving their current analysis until their batch is re-run and committed
+    try:
+        job_id = jobs.create_reanalysis_job(draft_version, section)
+        return {"status": "queued", "job_id": job_id}
+    except Exception as e:
+        logger.error("Error queueing re-analysis: %s", str(e))
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@app.get("/summary")
+@app.get("/summary/")
+def get_summary(draft_version: str, db: Session = Depends(get_db)):
+    row = db.get(DraftSummary, draft_version)
+    if row is None:
+        return JSONResponse(status_code=404, content={"error": f"No summary for {draft_version} yet"})
+    return summaries.summary_dict(row)
+
+
+@app.post("/summary/{draft_version}/refresh")
+def refresh_summary(draft_version: str):
+    return {"status": "queued", "job_id": jobs.create_summary_job(draft_version)}
+
+
+@app.get("/reports/{kind}")
+async def download_report(kind: str, background_tasks: BackgroundTasks, draft_version: str = None, section: str = None):
+    if kind not in reports.REPORT_KINDS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown report kind: {kind}"})
+    try:
+        path = await run_in_threadpool(reports.build_report, kind, draft_version, section)
+    except Exception as e:
+        logger.error("Error generating %s report: %s", kind, str(e))
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    suffix, media_type = reports.REPORT_KINDS[kind]
+    background_tasks.add_task(os.remove, path)  # after the file has been sent
+    return FileResponse(path, media_type=media_type, filename=f"report{suffix}")
+
+
+@app.get("/version")
+def data_version(db: Session = Depends(get_db)):
+    return data_versions(db)
+
+
+@app.get("/prefilter/stats")
+def prefilter_stats(db: Session = Depends(get_db)):
+    return prefilter.stats(db)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return analysis_cache.stats()
@@ -0,0 +1,217 @@
+import bisect
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from backend import config
+
+logger = logging.getLogger(__name__)
+
+# In-process metrics with Prometheus text exposition. LLM calls never leave this process
+# (see executor.io_kind); CPU stages sent to child processes are timed by the caller.
+_registry = []
+_registry_lock = threading.Lock()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, '') for n in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f'{self.name}{_labels(self.labelnames, key)} {value}' for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from `function`, which returns a number."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def _samples(self):
+        try:
+            return [f'{self.name} {float(self.function())}']
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, str(e))
+            return []
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), key + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+STAGE_SECONDS = Histogram('civicpulse_stage_seconds', 'Wall time of one pipeline stage call', ['stage'])
+STAGE_ITEMS = Counter('civicpulse_stage_items_total', 'Items (comments, texts) handled per pipeline stage', ['stage'])
+LLM_REQUEST_SECONDS = Histogram('civicpulse_llm_request_seconds', 'LLM HTTP request latency, per attempt', ['endpoint'])
+LLM_REQUESTS = Counter('civicpulse_llm_requests_total', 'LLM HTTP requests by outcome (ok, retry, error)', ['endpoint', 'outcome'])
+LLM_TOKENS = Counter('civicpulse_llm_tokens_total', 'Tokens reported by the LLM server', ['direction'])
+LLM_REQUEST_TOKENS = Histogram('civicpulse_llm_request_tokens', 'Tokens per LLM request', ['direction'], TOKEN_BUCKETS)
+LLM_PARSED_ITEMS = Counter('civicpulse_llm_parsed_items_total', 'Items parsed from LLM answers by result (ok, failed); '
+                           'failed / all is the parse failure rate', ['prompt', 'result'])
+
+
+class Trace:
+    """Per-job totals: time and items per stage, plus LLM requests and tokens."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages = {}
+        self.llm = {'requests': 0, 'seconds': 0.0, 'tokens_in': 0, 'tokens_out': 0, 'retries': 0, 'parsed': 0,
+                    'parse_failures': 0}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds, items):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'items': 0})
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['items'] += items or 0
+
+    def add_llm(self, **amounts):
+        with self._lock:
+            for field, amount in amounts.items():
+                self.llm[field] += amount
+
+    def to_dict(self):
+        with self._lock:
+            return {'started_at': self.started_at, 'elapsed_seconds': time.time() - self.started_at,
+                    'stages': {k: dict(v) for k, v in self.stages.items()}, 'llm': dict(self.llm)}
+
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def tracing(trace):
+    """Make `trace` the current trace for this thread (and work it hands to the shared executor)."""
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def trace_json():
+    trace = _trace.get()
+    return json.dumps(trace.to_dict()) if trace is not None else None
+
+
+@contextmanager
+def stage(name, items=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if items:
+            STAGE_ITEMS.inc(items, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add_stage(name, elapsed, items)
+
+
+def record_llm(endpoint, seconds, outcome, response=None):
+    LLM_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    LLM_REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    tokens_in = tokens_out = 0
+    if isinstance(response, dict):
+        tokens_in = response.get('prompt_eval_count') or 0
+        tokens_out = response.get('eval_count') or 0
+        for direction, count in (('in', tokens_in), ('out', tokens_out)):
+            if count:
+                LLM_TOKENS.inc(count, direction=direction)
+                LLM_REQUEST_TOKENS.observe(count, direction=direction)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_llm(requests=1, seconds=seconds, tokens_in=tokens_in, tokens_out=tokens_out,
+                      retries=int(outcome == 'retry'))
+
+
+def record_parse(prompt, ok=0, failed=0):
+    if ok:
+        LLM_PARSED_ITEMS.inc(ok, prompt=prompt, result='ok')
+    if failed:
+        LLM_PARSED_ITEMS.inc(failed, prompt=prompt, result='failed')
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_llm(parsed=ok, parse_failures=failed)
+
+
+def sampled(log, level=logging.DEBUG):
+    """Whether to emit a verbose hot-path log line: only when the level is enabled, and then for
+    a LOG_SAMPLE_RATE share of calls, so full prompts are not formatted for every comment."""
+    return log.isEnabledFor(level) and random.random() < config.LOG_SAMPLE_RATE
@@ -0,0 +1,156 @@
+import json
+import math
+import re
+
+SENTIMENTS = ('Positive', 'Negative', 'Neutral')
+
+# JSON schemas sent to Ollama as `format` (constrained decoding) and used to validate answers
+ANALYSIS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'sentiment': {'type': 'string', 'enum': list(SENTIMENTS)},
+        'confidence': {'type': 'number', 'minimum': 0, 'maximum': 100},
+        'summary': {'type': 'string'},
+        'keywords': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['sentiment', 'confidence', 'summary', 'keywords'],
+}
+BATCH_ITEM_SCHEMA = {
+    'type': 'object',
+    'properties': {'id': {'type': 'integer'}, **ANALYSIS_SCHEMA['properties']},
+    'required': ['id'] + ANALYSIS_SCHEMA['required'],
+}
+BATCH_SCHEMA = {'type': 'array', 'items': BATCH_ITEM_SCHEMA}
+STRING_LIST_SCHEMA = {'type': 'array', 'items': {'type': 'string'}}
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'integer': int,
+    'number': (int, float),
+    'boolean': bool,
+}
+_decoder = json.JSONDecoder()
+
+
+class ParseError(ValueError):
+    pass
+
+
+def validate(value, schema, path='$'):
+    """Errors of `value` against the subset of JSON schema used here (type, enum, required,
+    properties, items, minimum, maximum); an empty list means valid."""
+    expected = _TYPES.get(schema.get('type'))
+    if expected and (not isinstance(value, expected) or (isinstance(value, bool) and schema['type'] != 'boolean')):
+        return [f'{path}: expected {schema["type"]}']
+    if isinstance(value, float) and not math.isfinite(value):
+        return [f'{path}: not a finite number']
+    errors = []
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f'{path}: {value!r} not in {schema["enum"]}')
+    if 'minimum' in schema and value < schema['minimum']:
+        errors.append(f'{path}: below {schema["minimum"]}')
+    if 'maximum' in schema and value > schema['maximum']:
+        errors.append(f'{path}: above {schema["maximum"]}')
+    if isinstance(value, dict):
+        errors.extend(f'{path}.{key}: missing' for key in schema.get('required', ()) if key not in value)
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value:
+                errors.extend(validate(value[key], subschema, f'{path}.{key}'))
+    if isinstance(value, list) and 'items' in schema:
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema['items'], f'{path}[{i}]'))
+    return errors
+
+
+def iter_json(text, start_chars='{['):
+    """Yield every top-level JSON value embedded in `text` (prose, code fences and all), in order.
+    Each value is decoded on its own, so one broken value does not lose the ones after it."""
+    i = 0
+    while i < len(text):
+        if text[i] in start_chars:
+            try:
+                value, end = _decoder.raw_decode(text, i)
+            except ValueError:
+                i += 1
+                continue
+            yield value
+            i = end
+        else:
+            i += 1
+
+
+def iter_objects(text):
+    """Yield JSON objects from `text` one at a time, including the complete objects inside an
+    array that is itself malformed or cut off (e.g. by the token limit)."""
+    for value in iter_json(text):
+        if isinstance(value, list):
+            yield from (v for v in value if isinstance(v, dict))
+            continue
+        if isinstance(value, dict):
+            yield value
+
+
+def _coerce_analysis(data):
+    # Lenient fixes for harmless deviations, applied before strict validation
+    data = dict(data)
+    if isinstance(data.get('sentiment'), str):
+        data['sentiment'] = data['sentiment'].strip().capitalize()
+    if isinstance(data.get('confidence'), str):
+        try:
+            data['confidence'] = float(data['confidence'].strip().rstrip('%'))
+        except ValueError:
+            pass
+    confidence = data.get('confidence')
+    if isinstance(confidence, float) and 0 < confidence < 1:
+        data['confidence'] = confidence * 100  # a probability instead of a percentage; a whole 1 means 1%
+    if isinstance(data.get('keywords'), str):
+        data['keywords'] = [k.strip() for k in data['keywords'].split(',') if k.strip()]
+    if isinstance(data.get('keywords'), list):
+        data['keywords'] = [str(k) for k in data['keywords']]
+    if isinstance(data.get('id'), str) and data['id'].strip().isdigit():
+        data['id'] = int(data['id'])
+    return data
+
+
+def _analysis_tuple(data):
+    return data['sentiment'], float(data['confidence']), data['summary'].strip() or 'No summary', data['keywords']
+
+
+def parse_analysis(text):
+    """(sentiment, confidence, summary, keywords) from a single-comment answer; raises ParseError."""
+    errors = ['no JSON object found']
+    for value in iter_objects(text):
+        data = _coerce_analysis(value)
+        errors = validate(data, ANALYSIS_SCHEMA)
+        if not errors:
+            return _analysis_tuple(data)
+    raise ParseError('; '.join(errors[:3]))
+
+
+def parse_batch(text, ids):
+    """{id: analysis} for the valid items of a batch answer, plus the number of objects that were
+    rejected. Unknown ids and repeats of an id are ignored."""
+    parsed, rejected = {}, 0
+    for value in iter_objects(text):
+        data = _coerce_analysis(value)
+        if validate(data, BATCH_ITEM_SCHEMA) or data['id'] not in ids or data['id'] in parsed:
+            rejected += 1
+            continue
+        parsed[data['id']] = _analysis_tuple(data)
+    return parsed, rejected
+
+
+def parse_string_list(text, limit=None):
+    """A list of strings from the first JSON array in `text`; raises ParseError."""
+    for value in iter_json(text, '['):
+        if not validate(value, STRING_LIST_SCHEMA):
+            return [v.strip() for v in value if v.strip()][:limit]
+    raise ParseError('no JSON list of strings found')
+
+
+def strip_list_markup(text, limit=None):
+    # Last resort for prose answers: one item per line, without bullets or numbering
+    lines = [re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip() for line in text.splitlines()]
+    return [line for line in lines if line][:limit]
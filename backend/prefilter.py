@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import joblib
+import numpy as np
+from sqlalchemy import func
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from backend import config, metrics
+from backend.ai import FAILED_SUMMARIES
+from backend.db import Session, Comment
+from backend.keywords import top_keywords
+
+logger = logging.getLogger(__name__)
+
+# Lines that carry no opinion at all; answered without any model
+BOILERPLATE = {'', 'na', 'n a', 'nil', 'none', 'no comment', 'no comments', 'nothing', 'ok', 'okay', 'noted', 'same as above'}
+_WORDS = re.compile(r"[a-z]{3,}")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+_vectorizer = HashingVectorizer(n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False, norm='l2')
+_model = None
+_model_mtime = None
+_lock = threading.Lock()
+
+
+def _is_boilerplate(text):
+    return ' '.join(re.findall(r"[a-z0-9]+", text.lower())) in BOILERPLATE
+
+
+def _local_summary(text):
+    return _SENTENCE_END.split(text.strip(), 1)[0][:200]
+
+
+def _local_keywords(text):
+    return top_keywords([w for w in _WORDS.findall(text.lower()) if w not in ENGLISH_STOP_WORDS], 5)
+
+
+def load_model():
+    """The trained classifier, reloaded when the model file changes (e.g. after a retrain)."""
+    global _model, _model_mtime
+    path = config.PREFILTER_MODEL_PATH
+    with _lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            _model, _model_mtime = None, None
+            return None
+        if mtime != _model_mtime:
+            _model, _model_mtime = joblib.load(path), mtime
+        return _model
+
+
+def classify(texts, threshold=None):
+    """First-pass analysis for a batch. Returns one (sentiment, confidence, summary, keywords, tier)
+    per text, or None where the text has to go to the LLM."""
+    threshold = config.PREFILTER_THRESHOLD if threshold is None else threshold
+    results = [None] * len(texts)
+    candidates = []
+    for i, text in enumerate(texts):
+        text = str(text or '')
+        if _is_boilerplate(text):
+            results[i] = ('Neutral', 50.0, _local_summary(text) or 'No comment', [], 'rule')
+        else:
+            candidates.append(i)
+
+    bundle = load_model() if threshold < 1 else None
+    if bundle is None or not candidates:
+        return results
+    model = bundle['model']
+    with metrics.stage('prefilter', len(candidates)):
+        probabilities = model.predict_proba(_vectorizer.transform([str(texts[i]) for i in candidates]))
+    best = probabilities.argmax(axis=1)
+    for i, label, probability in zip(candidates, best.tolist(), probabilities.max(axis=1).tolist()):
+        if probability >= threshold:
+            text = str(texts[i])
+            results[i] = (model.classes_[label], round(probability * 100, 1), _local_summary(text),
+                          _local_keywords(text), 'prefilter')
+    return results
+
+
+def _training_rows(limit):
+    db = Session()
+    try:
+        # Only labels that came from the LLM (rows from before tiers existed have no tier)
+        query = db.query(Comment.translated_comment, Comment.original_comment, Comment.sentiment).filter(
+            Comment.sentiment.in_(['Positive', 'Negative', 'Neutral']),
+            (Comment.analysis_tier == 'llm') | Comment.analysis_tier.is_(None),
+            Comment.summary.notin_(FAILED_SUMMARIES),
+        ).order_by(Comment.id.desc()).limit(limit)
+        return [(translated or original or '', sentiment) for translated, original, sentiment in query.yield_per(5000)]
+    finally:
+        db.close()
+
+
+def train(threshold=None, min_rows=None, max_rows=None):
+    """Fit the classifier on LLM-labelled comments, evaluate it on a holdout split and save it.
+    Returns the evaluation metrics, which are saved with the model."""
+    threshold = config.PREFILTER_THRESHOLD if threshold is None else threshold
+    min_rows = min_rows or config.PREFILTER_MIN_TRAIN
+    rows = [r for r in _training_rows(max_rows or config.PREFILTER_MAX_TRAIN) if r[0].strip()]
+    if len(rows) < min_rows:
+        raise ValueError(f"Need at least {min_rows} LLM-labelled comments to train, found {len(rows)}")
+    texts = [t for t, _ in rows]
+    labels = np.array([s for _, s in rows])
+    order = np.random.default_rng(42).permutation(len(rows))
+    split = int(len(rows) * 0.8)
+    train_idx, test_idx = order[:split], order[split:]
+
+    X = _vectorizer.transform(texts)
+    model = SGDClassifier(loss='log_loss', alpha=1e-5, max_iter=20, tol=None, random_state=42)
+    model.fit(X[train_idx], labels[train_idx])
+
+    probabilities = model.predict_proba(X[test_idx])
+    predicted = model.classes_[probabilities.argmax(axis=1)]
+    confident = probabilities.max(axis=1) >= threshold
+    correct = predicted == labels[test_idx]
+    evaluation = {
+        'trained_at': time.time(),
+        'train_rows': int(len(train_idx)),
+        'holdout_rows': int(len(test_idx)),
+        'threshold': threshold,
+        'holdout_accuracy': float(correct.mean()),
+        'coverage': float(confident.mean()),  # share of comments the prefilter would answer
+        'prefilter_accuracy': float(correct[confident].mean()) if confident.any() else None,
+        'escalated_accuracy': float(correct[~confident].mean()) if (~confident).any() else None,
+    }
+
+    # Refit on everything before saving
+    model.fit(X, labels)
+    path = config.PREFILTER_MODEL_PATH
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump({'model': model, 'metrics': evaluation}, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    logger.info("Trained prefilter on %d comments: %s", len(rows), evaluation)
+    return evaluation
+
+
+def stats(db):
+    """Share of comments answered by each tier, plus the holdout metrics of the current model."""
+    counts = {}
+    for tier, n in db.query(Comment.analysis_tier, func.count(Comment.id)).group_by(Comment.analysis_tier):
+        counts[tier or 'llm'] = counts.get(tier or 'llm', 0) + n
+    total = sum(counts.values()) or 1
+    bundle = load_model()
+    return {
+        'tiers': {tier: {'comments': n, 'share': n / total} for tier, n in counts.items()},
+        'model': bundle['metrics'] if bundle else None,
+        'threshold': config.PREFILTER_THRESHOLD,
+    }
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['train']:
+        print(json.dumps(train(), indent=2))
+    else:
+        print("Usage: python -m backend.prefilter train")
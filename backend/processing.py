@@ -1,19 +1,30 @@
-from multiprocessing import Pool
 import pandas as pd
-import numpy as np
-from sklearn.cluster import KMeans
-from backend.ai import analyze_comment, get_recommendations, get_overall_summary, translate_to_english, get_embedding
+from backend import config, metrics
+from backend.ai import ANALYSIS_VERSION, analysis_failed, analyze_comment, analyze_comments, get_recommendations, get_embeddings
+from backend.vectors import pack_embedding
+from backend.clustering import assign_clusters
+from backend.dedup import assign_groups, stored_analyses
+from backend.executor import io_kind, map_ordered
+from backend.keywords import normalize_keywords
+from backend.prefilter import classify
+from backend.translation import translate_many, translate_to_english
 import logging
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
 
-def process_single(row):
-    original = row.get('comment', '')
-    lang = row.get('language', 'en')
-    translated = translate_to_english(original, lang)
-    sentiment, confidence, summary, keywords = analyze_comment(translated)
-    embedding = get_embedding(translated)
+def _embed(texts):
+    # An embedding failure must not cost the analysis already done: rows are stored without
+    # embeddings and clusters, and `python -m backend.vectors backfill` embeds them later
+    try:
+        return get_embeddings(texts)
+    except Exception as e:
+        logger.error("Embedding %d comments failed, storing them without embeddings: %s", len(texts), str(e))
+        return None
+
+def _build_result(row, original, translated, analysis, tier='llm'):
+    sentiment, confidence, summary, keywords = analysis
+    if analysis_failed(analysis):
+        tier = 'failed'  # a placeholder, not a judgement: kept out of training and picked up by re-analysis
     priority = "High" if sentiment == "Negative" and confidence > 70 else "Normal"
     return {
         "original_comment": original,
@@ -21,50 +32,127 @@ def process_single(row):
         "sentiment": sentiment,
         "confidence": float(confidence),  # Ensure float
         "summary": summary,
-        "keywords": ','.join(keywords) if keywords else '',
+        "keywords": normalize_keywords(keywords),  # also strips ',' which ScalarListType uses as separator
         "section": row.get('section', 'Unknown'),
         "priority": priority,
         "policy_recommendations": [],
         "draft_version": row.get('draft_version', 'v1'),
         "date": row.get('date', 'Unknown'),
         "stakeholder": row.get('stakeholder', ''),
-        "embedding": embedding
+        "analysis_tier": tier,
+        "analysis_version": ANALYSIS_VERSION,
     }
 
-def process_comments_batch(df, batch_size=100):
-    required_cols = ['comment', 'language', 'section', 'draft_version', 'date', 'stakeholder']
-    for col in required_cols:
-        if col not in df.columns:
-            df[col] = 'Unknown' if col in ['section', 'date'] else 'en' if col == 'language' else 'v1' if col == 'draft_version' else ''
-    with Pool(processes=4) as pool:
-        batches = [df[i:i + batch_size] for i in range(0, len(df), batch_size)]
-        results = []
-        for batch in batches:
-            batch_results = pool.map(process_single, batch.to_dict('records'))
-            results.extend(batch_results)
-
-    embeddings = np.array([eval(r['embedding']) for r in results])  # Convert string to list
-    if len(embeddings) > 1:
-        kmeans = KMeans(n_clusters=min(5, len(embeddings)), random_state=42)
-        clusters = kmeans.fit_predict(embeddings)
-        for i, cluster in enumerate(clusters):
-            results[i]['cluster'] = int(cluster)
+def process_single(row):
+    original = row.get('comment', '')
+    lang = row.get('language', 'en')
+    translated = translate_to_english(original, lang)
+    first_pass = classify([translated])[0]
+    if first_pass is not None:
+        return _build_result(row, original, translated, first_pass[:4], first_pass[4])
+    return _build_result(row, original, translated, analyze_comment(translated))
+
+def process_rows_batched(rows):
+    originals = [row.get('comment', '') for row in rows]
+    translated, _ = translate_many(originals, [row.get('language', 'en') for row in rows])
+    return [_build_result(row, original, text, analysis, tier)
+            for row, original, text, (analysis, tier) in zip(rows, originals, translated, _analyze_translated(translated))]
+
+def _analyze_translated(translated):
+    # Comments the local classifier is sure about never reach the LLM
+    first_pass = classify(translated)
+    escalated = [i for i, r in enumerate(first_pass) if r is None]
+    llm_results = dict(zip(escalated, analyze_comments([translated[i] for i in escalated])))
+    return [(llm_results[i], 'llm') if r is None else (r[:4], r[4]) for i, r in enumerate(first_pass)]
+
+def analyze_texts(texts):
+    """(analysis, tier) for already translated texts, in LLM_BATCH_SIZE units on the shared executor."""
+    step = max(config.LLM_BATCH_SIZE, 1)
+    units = [texts[j:j + step] for j in range(0, len(texts), step)]
+    return [r for unit in map_ordered(_analyze_translated, units, kind=io_kind()) for r in unit]
+
+def analysis_values(analysis, tier):
+    """The Comment columns an analysis sets, as in a pipeline result."""
+    result = _build_result({}, None, None, analysis, tier)
+    return {k: result[k] for k in ('sentiment', 'confidence', 'summary', 'keywords', 'priority', 'analysis_tier', 'analysis_version')}
+
+def _fan_out(row, base, translated):
+    # A duplicate reuses its group's analysis; only its own text and metadata differ
+    original = row.get('comment', '')
+    analysis = (base['sentiment'], base['confidence'], base['summary'], base['keywords'] or [])
+    result = _build_result(row, original, translated, analysis, 'duplicate')
+    result['analysis_version'] = base.get('analysis_version')  # the group's analysis may predate the current one
+    return result
+
+ROW_DEFAULTS = {'comment': '', 'language': 'en', 'section': 'Unknown', 'draft_version': 'v1', 'date': 'Unknown', 'stakeholder': ''}
+
+def _with_defaults(row):
+    # Missing columns and blank cells (None/NaN) both fall back to the defaults
+    return {**row, **{col: default for col, default in ROW_DEFAULTS.items() if pd.isna(row.get(col))}}
+
+def _analyze_records(records):
+    if not records:
+        return []
+    # Work units are streamed through the shared thread executor with no barrier between them, so
+    # a slow prompt only holds up its own slot; the LLM client caps requests in flight
+    if config.LLM_BATCH_SIZE > 1:
+        step = config.LLM_BATCH_SIZE
+        units = [records[j:j + step] for j in range(0, len(records), step)]
+        return [r for batch_results in map_ordered(process_rows_batched, units, kind=io_kind()) for r in batch_results]
+    return map_ordered(process_single, records, kind=io_kind())
+
+def process_records(records):
+    records = [_with_defaults(r) for r in records]
+    groups = [None] * len(records)
+    stored, representatives = {}, {}
+    if config.DEDUP_ENABLED:
+        # Each duplicate group is analyzed once: by an earlier upload (stored) or by its first row here
+        with metrics.stage('dedup', len(records)):
+            groups, existing = assign_groups([r['draft_version'] for r in records], [str(r['comment']) for r in records])
+            stored = stored_analyses(existing)
+        for i, group in enumerate(groups):
+            if group not in stored and group not in representatives:
+                representatives[group] = i
+        to_analyze = sorted(representatives.values())
     else:
-        for r in results:
-            r['cluster'] = None
+        to_analyze = list(range(len(records)))
+
+    results = [None] * len(records)
+    for i, result in zip(to_analyze, _analyze_records([records[i] for i in to_analyze])):
+        results[i] = result
+    duplicates = [i for i, r in enumerate(results) if r is None]
+    translated, _ = translate_many([records[i]['comment'] for i in duplicates], [records[i]['language'] for i in duplicates])
+    for i, text in zip(duplicates, translated):
+        group = groups[i]
+        results[i] = _fan_out(records[i], stored.get(group) or results[representatives[group]], text)
+    for i, group in enumerate(groups):
+        results[i]['duplicate_group'] = group
 
-    negative_comments = [r['translated_comment'] for r in results if r['sentiment'] == 'Negative']
-    recommendations = get_recommendations(negative_comments)
-    for r in results:
-        if r['sentiment'] == 'Negative':
-            r['policy_recommendations'] = recommendations
+    embeddings = _embed([r['translated_comment'] for r in results])
+    if embeddings is None:
+        for r in results:
+            r['embedding'] = r['cluster'] = None
+        return results
+    for r, vector in zip(results, embeddings):
+        r['embedding'] = pack_embedding(vector)
 
-    all_summaries = [r['summary'] for r in results]
-    overall_summary = get_overall_summary(all_summaries)
-    logger.debug("Overall summary: %s", overall_summary)
+    # Clusters come from the draft's persistent centroids, so ids are comparable across uploads
+    by_draft = {}
+    for i, r in enumerate(results):
+        by_draft.setdefault(r['draft_version'], []).append(i)
+    for draft_version, indices in by_draft.items():
+        with metrics.stage('cluster', len(indices)):
+            clusters = assign_clusters(draft_version, embeddings[indices])
+        for i, cluster in zip(indices, clusters):
+            results[i]['cluster'] = cluster
 
+    # Draft-level summaries and recommendations cover every comment and are built by
+    # summary jobs (backend.summaries) after an upload, not per batch
     return results
 
+def process_comments_batch(df):
+    return process_records(df.to_dict('records'))
+
 def process_single_comment(comment, language='en', section='Unknown', draft_version='v1', date='Unknown', stakeholder=''):
     row = {
         'comment': comment,
@@ -74,7 +162,20 @@ def process_single_comment(comment, language='en', section='Unknown', draft_vers
         'date': date,
         'stakeholder': stakeholder
     }
-    processed = process_single(row)
-    processed['cluster'] = None
+    group, stored = None, {}
+    if config.DEDUP_ENABLED:
+        groups, existing = assign_groups([draft_version], [str(comment)])
+        group, stored = groups[0], stored_analyses(existing)
+    if group in stored:
+        processed = _fan_out(row, stored[group], translate_to_english(comment, language))
+    else:
+        processed = process_single(row)
+    processed['duplicate_group'] = group
+    embeddings = _embed([processed['translated_comment']])
+    processed['embedding'] = processed['cluster'] = None
+    if embeddings is not None:
+        processed['embedding'] = pack_embedding(embeddings[0])
+        with metrics.stage('cluster', 1):
+            processed['cluster'] = assign_clusters(draft_version, embeddings)[0]
     processed['policy_recommendations'] = get_recommendations([processed['translated_comment']]) if processed['sentiment'] == 'Negative' else []
     return processed
\ No newline at end of file
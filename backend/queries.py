@@ -0,0 +1,142 @@
+import io
+import json
+
+from backend.db import Session, Comment, CommentKeyword, DuplicateGroup, Keyword
+from backend.keywords import normalize_keyword
+from backend.vectors import unpack_embedding
+
+try:
+    import pyarrow  # noqa: F401  (optional: arrow and parquet output)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Fields read from a joined table rather than the comments row
+JOINED_FIELDS = {'duplicate_group_size': DuplicateGroup.size}
+ALL_FIELDS = [c.name for c in Comment.__table__.columns] + list(JOINED_FIELDS)
+# Embeddings and translations are large and unused by the dashboard; ask for them explicitly
+DEFAULT_FIELDS = [f for f in ALL_FIELDS if f not in ('embedding', 'translated_comment')]
+STREAM_BATCH = 2000
+
+
+def parse_fields(fields=None, include_embedding=False):
+    selected = DEFAULT_FIELDS if not fields else [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in selected if f not in ALL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if include_embedding and 'embedding' not in selected:
+        selected = selected + ['embedding']
+    # id is always returned; it is the pagination cursor
+    return ['id'] + [f for f in selected if f != 'id']
+
+
+def comment_query(db, fields, draft_version=None, section=None, keyword=None, after_id=None, sentiment=None):
+    query = db.query(*[JOINED_FIELDS[f].label(f) if f in JOINED_FIELDS else getattr(Comment, f) for f in fields])
+    if 'duplicate_group_size' in fields:
+        query = query.select_from(Comment).outerjoin(DuplicateGroup, DuplicateGroup.id == Comment.duplicate_group)
+    if draft_version:
+        query = query.filter(Comment.draft_version == draft_version)
+    if section:
+        query = query.filter(Comment.section == section)
+    if sentiment:
+        query = query.filter(Comment.sentiment == sentiment)
+    if keyword:
+        # Posting list lookup in the inverted index rather than a LIKE over every row
+        postings = db.query(CommentKeyword.comment_id).join(Keyword, Keyword.id == CommentKeyword.keyword_id)
+        query = query.filter(Comment.id.in_(postings.filter(Keyword.term == normalize_keyword(keyword))))
+    if after_id is not None:
+        query = query.filter(Comment.id > after_id)
+    return query.order_by(Comment.id)
+
+
+def row_to_dict(row):
+    item = row._asdict()
+    if item.get('embedding') is not None:
+        item['embedding'] = unpack_embedding(item['embedding']).tolist()
+    return item
+
+
+def fetch_page(db, fields, limit, **filters):
+    """One keyset page; returns (rows, next_after_id or None)."""
+    rows = [row_to_dict(r) for r in comment_query(db, fields, **filters).limit(limit + 1)]
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['id']
+    return rows, None
+
+
+def iter_rows(fields, limit=None, **filters):
+    """Stream rows from a server-side cursor in batches, with a session of its own so it can
+    outlive the request handler."""
+    db = Session()
+    try:
+        query = comment_query(db, fields, **filters)
+        if limit:
+            query = query.limit(limit)
+        for row in query.yield_per(STREAM_BATCH):
+            yield row_to_dict(row)
+    finally:
+        db.close()
+
+
+def iter_ndjson(rows):
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row, default=str))
+        if len(batch) >= 500:
+            yield '\n'.join(batch) + '\n'
+            batch = []
+    if batch:
+        yield '\n'.join(batch) + '\n'
+
+
+def arrow_schema(fields):
+    import pyarrow as pa
+    types = {'Integer': pa.int64(), 'Float': pa.float64(), 'String': pa.string(),
+             'LargeBinary': pa.list_(pa.float32()), 'ScalarListType': pa.list_(pa.string())}
+    columns = {c.name: c for c in Comment.__table__.columns}
+    columns.update((f, column.expression) for f, column in JOINED_FIELDS.items())
+    return pa.schema([(f, types.get(type(columns[f].type).__name__, pa.string())) for f in fields])
+
+
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_arrow_stream(rows, fields):
+    """Arrow IPC stream, one record batch per STREAM_BATCH rows."""
+    import pyarrow as pa
+    schema = arrow_schema(fields)
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= STREAM_BATCH:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+            batch = []
+            yield sink.drain()
+    if batch:
+        writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+    writer.close()
+    yield sink.drain()
+
+
+def parquet_bytes(rows, fields):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    out = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist(rows, schema=arrow_schema(fields)), out, compression='zstd')
+    return out.getvalue()
@@ -0,0 +1,124 @@
+import json
+import logging
+import sys
+import time
+
+from sqlalchemy import func, or_
+
+from backend import config, metrics
+from backend.ai import ANALYSIS_VERSION
+from backend.db import Session, Comment, bump_data_version
+from backend.keywords import index_keywords, unindex_keywords
+from backend.processing import analysis_values, analyze_texts
+from backend.rollups import ROLLUP_FIELDS, update_rollups
+
+logger = logging.getLogger(__name__)
+
+
+def stale_filter():
+    # Rows from another model or prompt, from before versions were stored, or that the LLM failed on
+    return or_(Comment.analysis_version.is_(None), Comment.analysis_version != ANALYSIS_VERSION,
+               Comment.analysis_tier == 'failed')
+
+
+def stale_query(db, draft_version=None, section=None):
+    query = db.query(Comment).filter(stale_filter())
+    if draft_version:
+        query = query.filter(Comment.draft_version == draft_version)
+    if section:
+        query = query.filter(Comment.section == section)
+    return query
+
+
+def status(db, draft_version=None):
+    """Stale row counts per draft and section, largest first."""
+    query = db.query(Comment.draft_version, Comment.section, func.count(Comment.id)).filter(stale_filter())
+    if draft_version:
+        query = query.filter(Comment.draft_version == draft_version)
+    counts = query.group_by(Comment.draft_version, Comment.section).order_by(func.count(Comment.id).desc()).all()
+    return {
+        "analysis_version": ANALYSIS_VERSION,
+        "model": config.LLM_MODEL,
+        "stale": sum(n for _, _, n in counts),
+        "by_section": [{"draft_version": d, "section": s, "stale": n} for d, s, n in counts],
+    }
+
+
+def _snapshot(row):
+    return {f: getattr(row, f) for f in ROLLUP_FIELDS}
+
+
+def reanalyze_batch(db, draft_version=None, section=None, after_id=0, batch_size=None):
+    """Re-run analysis for the next batch of stale rows with id > after_id and commit it.
+    Each duplicate group is analyzed once, and its other stale members get the same result.
+    Returns (rows updated, last id of the batch, drafts touched); (0, after_id, set()) when nothing is left."""
+    batch_size = batch_size or config.REANALYSIS_BATCH
+    rows = stale_query(db, draft_version, section).filter(Comment.id > after_id).order_by(Comment.id).limit(batch_size).all()
+    if not rows:
+        return 0, after_id, set()
+    ids = {r.id for r in rows}
+    groups = sorted({r.duplicate_group for r in rows if r.duplicate_group is not None})
+    for start in range(0, len(groups), 500):
+        rows.extend(stale_query(db).filter(Comment.duplicate_group.in_(groups[start:start + 500]),
+                                           Comment.id.notin_(ids)))
+
+    representatives = {}
+    for row in rows:
+        representatives.setdefault(row.duplicate_group if row.duplicate_group is not None else ('row', row.id), row)
+    keys = list(representatives)
+    analyses = dict(zip(keys, analyze_texts(
+        [representatives[k].translated_comment or representatives[k].original_comment or '' for k in keys])))
+
+    # Swap the rows' contributions to rollups and the keyword index in the same transaction
+    update_rollups(db, [_snapshot(r) for r in rows], sign=-1)
+    unindex_keywords(db, [r.id for r in rows])
+    for row in rows:
+        key = row.duplicate_group if row.duplicate_group is not None else ('row', row.id)
+        analysis, tier = analyses[key]
+        values = analysis_values(analysis, tier if representatives[key] is row else 'duplicate')
+        for field, value in values.items():
+            setattr(row, field, value)
+    db.flush()
+    update_rollups(db, [_snapshot(r) for r in rows])
+    index_keywords(db, [(r.id, r.keywords) for r in rows])
+    bump_data_version(db, rewrite=True)
+    with metrics.stage('db_commit', len(rows)):
+        db.commit()
+    return len(rows), max(ids), {r.draft_version for r in rows}
+
+
+def throttle(rows, started):
+    # Keep a background re-run below REANALYSIS_MAX_RATE rows/s so uploads and the API keep the LLM
+    if config.REANALYSIS_MAX_RATE > 0 and rows:
+        time.sleep(max(rows / config.REANALYSIS_MAX_RATE - (time.time() - started), 0))
+
+
+def reanalyze(draft_version=None, section=None):
+    """Re-run every stale row in the scope in the foreground (CLI); returns the number updated."""
+    db = Session()
+    try:
+        total, after_id = 0, 0
+        while True:
+            started = time.time()
+            updated, after_id, _ = reanalyze_batch(db, draft_version, section, after_id)
+            if not updated:
+                return total
+            total += updated
+            logger.info("Re-analyzed %d rows", total)
+            throttle(updated, started)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] in ('status', 'run') and len(sys.argv) <= 4:
+        scope = sys.argv[2:] + [None] * (4 - len(sys.argv))
+        if sys.argv[1] == 'run':
+            print(f"Re-analyzed {reanalyze(*scope)} rows")
+        db = Session()
+        try:
+            print(json.dumps(status(db, scope[0]), indent=2))
+        finally:
+            db.close()
+    else:
+        print("Usage: python -m backend.reanalysis status|run [draft_version] [section]")
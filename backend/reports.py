@@ -0,0 +1,52 @@
+import os
+import tempfile
+
+from backend import rollups
+from backend.db import Session
+from backend.queries import iter_rows
+from utils.report import REPORT_FIELDS, write_excel_report, write_pdf_report
+
+REPORT_KINDS = {'pdf': ('.pdf', 'application/pdf'),
+                'excel': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
+
+
+def report_summary(draft_version=None, section=None):
+    """Summary sections for a report, aggregated from the rollup tables rather than the rows."""
+    db = Session()
+    try:
+        totals = rollups.sentiment_totals(db, draft_version, section)
+        by_section = rollups.sentiment_by_section(db, draft_version, section)
+        keywords = rollups.keyword_sentiment(db, draft_version, section, limit=10)
+        stakeholders = rollups.top_stakeholders(db, draft_version, section, limit=10)
+    finally:
+        db.close()
+    keyword_totals = {}
+    for r in keywords:
+        keyword_totals[r['keyword']] = keyword_totals.get(r['keyword'], 0) + r['count']
+    return [
+        ("Sentiment", ("Sentiment", "Comments"), [(r['sentiment'], r['count']) for r in totals]),
+        ("Sentiment per section", ("Section", "Sentiment", "Comments"),
+         [(r['section'], r['sentiment'], r['count']) for r in by_section]),
+        ("Top keywords", ("Keyword", "Comments"), sorted(keyword_totals.items(), key=lambda kv: -kv[1])),
+        ("Top stakeholders", ("Stakeholder", "Comments", "Characters"),
+         [(r['stakeholder'], r['comments'], r['characters']) for r in stakeholders]),
+    ]
+
+
+def build_report(kind, draft_version=None, section=None):
+    """Write a report to a fresh temp file and return its path; the caller deletes it.
+    Rows stream from a server-side cursor, so memory does not grow with the row count."""
+    suffix, _ = REPORT_KINDS[kind]
+    fd, path = tempfile.mkstemp(prefix='report-', suffix=suffix)
+    os.close(fd)
+    try:
+        summary = report_summary(draft_version, section)
+        rows = iter_rows(REPORT_FIELDS, draft_version=draft_version, section=section)
+        if kind == 'pdf':
+            write_pdf_report(path, rows, summary)
+        else:
+            write_excel_report(path, rows, REPORT_FIELDS, summary)
+        return path
+    except Exception:
+        os.remove(path)
+        raise
@@ -0,0 +1,163 @@
+import logging
+import sys
+from collections import Counter
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.db import Session, Comment, SentimentDateRollup, KeywordSentimentRollup, StakeholderRollup
+from backend.keywords import normalize_keywords
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ('draft_version', 'section', 'date', 'sentiment', 'keywords', 'stakeholder', 'original_comment')
+
+
+def _dim(value):
+    # Rollup dimensions are primary key columns, so they cannot be NULL
+    return '' if value is None else str(value)
+
+
+def _count(items, sign=1):
+    by_date, by_keyword, by_stakeholder, characters = Counter(), Counter(), Counter(), Counter()
+    for item in items:
+        draft_version, section, sentiment = _dim(item.get('draft_version')), _dim(item.get('section')), _dim(item.get('sentiment'))
+        by_date[(draft_version, section, _dim(item.get('date')), sentiment)] += sign
+        for keyword in normalize_keywords(item.get('keywords')):
+            by_keyword[(draft_version, section, keyword, sentiment)] += sign
+        stakeholder_key = (draft_version, section, _dim(item.get('stakeholder')))
+        by_stakeholder[stakeholder_key] += sign
+        characters[stakeholder_key] += sign * len(item.get('original_comment') or '')
+    return by_date, by_keyword, by_stakeholder, characters
+
+
+def _upsert(session, model, rows, value_columns):
+    if not rows:
+        return
+    table = model.__table__
+    keys = [c.name for c in table.primary_key.columns]
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        stmt = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={c: table.c[c] + stmt.excluded[c] for c in value_columns},
+        )
+        session.execute(stmt, rows)
+        return
+    for row in rows:
+        existing = session.get(model, tuple(row[k] for k in keys))
+        if existing is None:
+            session.add(model(**row))
+        else:
+            for c in value_columns:
+                setattr(existing, c, getattr(existing, c) + row[c])
+
+
+def update_rollups(session, items, sign=1):
+    """Fold inserted (sign=1) or removed (sign=-1) comments into the rollup tables.
+    Runs in the caller's transaction so rollups commit together with the comments."""
+    by_date, by_keyword, by_stakeholder, characters = _count(items, sign)
+    _upsert(session, SentimentDateRollup, [
+        {'draft_version': d, 'section': s, 'date': dt, 'sentiment': st, 'count': n}
+        for (d, s, dt, st), n in by_date.items()
+    ], ['count'])
+    _upsert(session, KeywordSentimentRollup, [
+        {'draft_version': d, 'section': s, 'keyword': k, 'sentiment': st, 'count': n}
+        for (d, s, k, st), n in by_keyword.items()
+    ], ['count'])
+    _upsert(session, StakeholderRollup, [
+        {'draft_version': d, 'section': s, 'stakeholder': sh, 'count': n, 'characters': characters[(d, s, sh)]}
+        for (d, s, sh), n in by_stakeholder.items()
+    ], ['count', 'characters'])
+
+
+def rebuild_rollups(batch_size=5000):
+    reader, writer = Session(), Session()
+    try:
+        for model in (SentimentDateRollup, KeywordSentimentRollup, StakeholderRollup):
+            writer.query(model).delete()
+        batch, total = [], 0
+        query = reader.query(*[getattr(Comment, f) for f in ROLLUP_FIELDS])
+        for row in query.yield_per(batch_size):
+            batch.append(row._asdict())
+            if len(batch) >= batch_size:
+                update_rollups(writer, batch)
+                total += len(batch)
+                batch = []
+        update_rollups(writer, batch)
+        writer.commit()
+        return total + len(batch)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def ensure_rollups():
+    # Databases created before rollups existed get them built once
+    db = Session()
+    try:
+        missing = db.query(SentimentDateRollup).first() is None and db.query(Comment.id).first() is not None
+    finally:
+        db.close()
+    if missing:
+        logger.info("Building rollups from existing comments")
+        rebuild_rollups()
+
+
+def _filter(query, model, draft_version=None, section=None):
+    if draft_version:
+        query = query.filter(model.draft_version == draft_version)
+    if section:
+        query = query.filter(model.section == section)
+    return query
+
+
+def sentiment_totals(db, draft_version=None, section=None):
+    M = SentimentDateRollup
+    total = func.sum(M.count)
+    query = _filter(db.query(M.sentiment, total), M, draft_version, section).group_by(M.sentiment).having(total > 0)
+    return [{"sentiment": s, "count": int(n)} for s, n in query]
+
+
+def sentiment_by_date(db, draft_version=None, section=None):
+    M = SentimentDateRollup
+    total = func.sum(M.count)
+    query = _filter(db.query(M.date, M.sentiment, total), M, draft_version, section)
+    query = query.group_by(M.date, M.sentiment).having(total > 0).order_by(M.date)
+    return [{"date": d, "sentiment": s, "count": int(n)} for d, s, n in query]
+
+
+def sentiment_by_section(db, draft_version=None, section=None):
+    M = SentimentDateRollup
+    total = func.sum(M.count)
+    query = _filter(db.query(M.section, M.sentiment, total), M, draft_version, section)
+    query = query.group_by(M.section, M.sentiment).having(total > 0).order_by(M.section)
+    return [{"section": sec, "sentiment": s, "count": int(n)} for sec, s, n in query]
+
+
+def keyword_sentiment(db, draft_version=None, section=None, limit=20):
+    M = KeywordSentimentRollup
+    total = func.sum(M.count)
+    top = _filter(db.query(M.keyword, total), M, draft_version, section)
+    top = [k for k, _ in top.group_by(M.keyword).having(total > 0).order_by(total.desc(), M.keyword).limit(limit)]
+    if not top:
+        return []
+    query = _filter(db.query(M.keyword, M.sentiment, total), M, draft_version, section)
+    query = query.filter(M.keyword.in_(top)).group_by(M.keyword, M.sentiment).having(total > 0)
+    return [{"keyword": k, "sentiment": s, "count": int(n)} for k, s, n in query]
+
+
+def top_stakeholders(db, draft_version=None, section=None, limit=5):
+    M = StakeholderRollup
+    chars = func.sum(M.characters)
+    query = _filter(db.query(M.stakeholder, func.sum(M.count), chars), M, draft_version, section)
+    query = query.group_by(M.stakeholder).having(func.sum(M.count) > 0).order_by(chars.desc()).limit(limit)
+    return [{"stakeholder": sh, "comments": int(n), "characters": int(c)} for sh, n, c in query]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['rebuild']:
+        print(f"Rolled up {rebuild_rollups()} comments")
+    else:
+        print("Usage: python -m backend.rollups rebuild")
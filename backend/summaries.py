@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import sys
+import time
+
+from backend import config, llm, metrics
+from backend.ai import get_recommendations
+from backend.cache import ResultCache, make_key, normalize_text
+from backend.db import Session, Comment, DraftSummary, bump_data_version
+
+logger = logging.getLogger(__name__)
+
+MAP_PROMPT = """
+        Summarize the main points raised in these stakeholder comments on a draft policy:
+        {texts}
+        Return ONLY a concise paragraph.
+        """
+REDUCE_PROMPT = """
+        Combine these partial summaries of stakeholder comments on a draft policy into one:
+        {texts}
+        Return ONLY a concise paragraph that keeps every distinct point.
+        """
+CONCERNS_PROMPT = """
+        List the concerns raised in these critical stakeholder comments on a draft policy:
+        {texts}
+        Return ONLY a concise paragraph.
+        """
+PROMPTS = {'map': MAP_PROMPT, 'reduce': REDUCE_PROMPT, 'concerns': CONCERNS_PROMPT}
+SUMMARY_PROMPT_VERSION = hashlib.sha256(''.join(PROMPTS.values()).encode('utf-8')).hexdigest()[:12]
+
+# Partial summaries are keyed on their exact inputs, so a refresh after an upload only
+# calls the LLM for leaves whose comments changed and the branches above them
+summary_cache = ResultCache('summary')
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _pack(texts, max_items, token_budget):
+    """Greedy in-order packing. Chunk boundaries depend only on the texts before them,
+    so appending comments leaves every earlier chunk (and its cache entry) unchanged."""
+    chunk, tokens = [], 0
+    for text in texts:
+        cost = _estimate_tokens(text)
+        if chunk and (len(chunk) >= max_items or tokens + cost > token_budget):
+            yield chunk
+            chunk, tokens = [], 0
+        chunk.append(text)
+        tokens += cost
+    if chunk:
+        yield chunk
+
+
+def _clip(text, token_budget):
+    # No single input may take more than half a call, so every reduce step at least halves the list
+    limit = max(token_budget // 2 - 1, 1) * 4
+    return text if len(text) <= limit else text[:limit]
+
+
+def _summarize_chunks(chunks, kind, stats):
+    keys = [make_key(kind, config.LLM_MODEL, SUMMARY_PROMPT_VERSION, *[normalize_text(t) for t in chunk])
+            for chunk in chunks]
+    results = [summary_cache.get(key) for key in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    prompts = [[{'role': 'user', 'content': PROMPTS[kind].format(texts='\n'.join(f'- {t}' for t in chunks[i]))}]
+               for i in missing]
+    stats['llm_calls'] += len(prompts)
+    with metrics.stage('summarize', len(prompts)):
+        responses = llm.chat_many(prompts, model=config.LLM_MODEL) if prompts else []
+    for i, response in zip(missing, responses):
+        if isinstance(response, Exception):
+            logger.error("Summary chunk failed: %s", str(response))
+            continue
+        results[i] = response['message']['content'].strip()
+        summary_cache.put(keys[i], results[i])
+    return [r for r in results if r]
+
+
+def reduce_texts(texts, kind='map', stats=None, max_items=None, token_budget=None):
+    """Summarize texts (any iterable, e.g. a cursor) in leaf chunks, several calls at a time,
+    then merge the partial summaries level by level until one remains. Every input is read;
+    the cost is about total tokens / budget calls."""
+    stats = stats if stats is not None else {'llm_calls': 0}
+    max_items = max_items or config.SUMMARY_LEAF_SIZE
+    token_budget = token_budget or config.SUMMARY_TOKEN_BUDGET
+    window = max(config.LLM_CONCURRENCY, 1) * 4
+    level, pending = [], []
+    for chunk in _pack((_clip(t, token_budget) for t in texts if t and t.strip()), max_items, token_budget):
+        pending.append(chunk)
+        if len(pending) >= window:
+            level.extend(_summarize_chunks(pending, kind, stats))
+            pending = []
+    if pending:
+        level.extend(_summarize_chunks(pending, kind, stats))
+    while len(level) > 1:
+        chunks = list(_pack([_clip(t, token_budget) for t in level], len(level), token_budget))
+        level = _summarize_chunks(chunks, 'reduce', stats)
+    return level[0] if level else None
+
+
+def _texts(query):
+    for translated, original in query.yield_per(2000):
+        yield translated or original or ''
+
+
+def _groups(db, draft_version):
+    # Leaves follow topic clusters (falling back to sections) so partial summaries stay on one topic
+    base = db.query(Comment.translated_comment, Comment.original_comment).filter(Comment.draft_version == draft_version)
+    clusters = [c for (c,) in db.query(Comment.cluster).filter(Comment.draft_version == draft_version).distinct()]
+    for cluster in sorted(c for c in clusters if c is not None):
+        yield f'cluster {cluster}', base.filter(Comment.cluster == cluster).order_by(Comment.id)
+    if None in clusters:
+        sections = [s for (s,) in db.query(Comment.section).filter(
+            Comment.draft_version == draft_version, Comment.cluster.is_(None)).distinct()]
+        for section in sorted(sections, key=str):
+            yield f'section {section}', base.filter(Comment.cluster.is_(None), Comment.section == section).order_by(Comment.id)
+
+
+def summarize_draft(draft_version):
+    """Recompute and store the draft's overall summary, per-cluster summaries and recommendations."""
+    started = time.time()
+    stats = {'llm_calls': 0}
+    db = Session()
+    try:
+        group_summaries = {}
+        for group, query in _groups(db, draft_version):
+            summary = reduce_texts(_texts(query), 'map', stats)
+            if summary:
+                group_summaries[group] = summary
+        if len(group_summaries) > 1:
+            overall = reduce_texts(list(group_summaries.values()), 'reduce', stats)
+        else:
+            overall = next(iter(group_summaries.values()), None)
+        negatives = db.query(Comment.translated_comment, Comment.original_comment).filter(
+            Comment.draft_version == draft_version, Comment.sentiment == 'Negative').order_by(Comment.id)
+        concerns = reduce_texts(_texts(negatives), 'concerns', stats)
+        recommendations = get_recommendations([concerns]) if concerns else []
+        stats['llm_calls'] += 1 if concerns else 0
+
+        row = DraftSummary(
+            draft_version=draft_version,
+            summary=overall or "No summaries.",
+            recommendations=json.dumps(recommendations),
+            cluster_summaries=json.dumps(group_summaries),
+            comments_covered=db.query(Comment.id).filter(Comment.draft_version == draft_version).count(),
+            llm_calls=stats['llm_calls'],
+            updated_at=time.time(),
+        )
+        db.merge(row)
+        bump_data_version(db)
+        db.commit()
+        logger.info("Summarized %s: %d comments, %d LLM calls in %.1fs", draft_version,
+                    row.comments_covered, stats['llm_calls'], time.time() - started)
+        return summary_dict(row)
+    finally:
+        db.close()
+
+
+def summary_dict(row):
+    return {
+        "draft_version": row.draft_version,
+        "summary": row.summary,
+        "recommendations": json.loads(row.recommendations or '[]'),
+        "cluster_summaries": json.loads(row.cluster_summaries or '{}'),
+        "comments_covered": row.comments_covered,
+        "llm_calls": row.llm_calls,
+        "updated_at": row.updated_at,
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'refresh':
+        print(json.dumps(summarize_draft(sys.argv[2]), indent=2))
+    else:
+        print("Usage: python -m backend.summaries refresh <draft_version>")
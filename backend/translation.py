@@ -0,0 +1,153 @@
+import importlib
+import logging
+import re
+from collections import defaultdict
+
+from langdetect import DetectorFactory, LangDetectException, detect
+
+from backend import config, llm, metrics
+from backend.cache import ResultCache, make_key
+
+logger = logging.getLogger(__name__)
+
+DetectorFactory.seed = 0  # langdetect is randomized; keep detection stable across runs
+
+AUTO = ('', 'auto', None)
+_NON_LATIN = re.compile(r'[^\x00-\u024f\u2000-\u206f\s\d]')  # anything outside Latin script and punctuation
+_WORDS = re.compile(r"[a-z']+")
+# Function words common enough that two of them make a Latin-script text English without langdetect
+ENGLISH_MARKERS = {'the', 'and', 'is', 'are', 'to', 'of', 'in', 'for', 'this', 'that', 'it', 'be', 'not',
+                   'should', 'will', 'with', 'on', 'we', 'i', 'you', 'they', 'was', 'have', 'has', 'please'}
+GOOGLE_MAX_CHARS = 4500  # the web endpoint rejects payloads over 5000 characters
+
+OLLAMA_PROMPT = """
+        Translate the following text from language code '{language}' to English.
+        Text: '{text}'
+        Return ONLY the English translation.
+        """
+
+# Translation memory: keyed on the exact source text, its language and the backend
+translation_cache = ResultCache('translation')
+
+
+def _looks_english(text):
+    words = _WORDS.findall(text.lower())
+    return len(words) < 3 or sum(w in ENGLISH_MARKERS for w in words) >= 2
+
+
+def detect_language(text, hint=None):
+    """Language of one text. An explicit non-English hint is trusted; 'en' (the default for
+    rows without a language column) is only overridden for text that is clearly not English."""
+    text = str(text or '').strip()
+    if hint not in AUTO and hint != 'en':
+        return hint
+    if not text or (not _NON_LATIN.search(text) and (hint == 'en' or _looks_english(text))):
+        return 'en'
+    try:
+        return detect(text)
+    except LangDetectException:
+        return hint if hint not in AUTO else 'en'
+
+
+def detect_languages(texts, hints=None):
+    """Detect a batch at once: each distinct (text, hint) is detected once, and the common case of
+    plain English text is settled by a script and function-word check without langdetect."""
+    hints = hints if hints is not None else [None] * len(texts)
+    detected = {}
+    for key in zip(texts, hints):
+        if key not in detected:
+            detected[key] = detect_language(*key)
+    return [detected[key] for key in zip(texts, hints)]
+
+
+def _chunks(texts, max_items, max_chars):
+    chunk, size = [], 0
+    for text in texts:
+        if chunk and (len(chunk) >= max_items or size + len(text) + 1 > max_chars):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(text)
+        size += len(text) + 1
+    if chunk:
+        yield chunk
+
+
+def _google_backend(texts, language):
+    # Several lines per request; deep-translator's translate_batch would make one request each
+    from deep_translator import GoogleTranslator
+    translator = GoogleTranslator(source=language, target='en')
+    results = []
+    for chunk in _chunks([re.sub(r'\s+', ' ', t) for t in texts], config.TRANSLATE_BATCH_SIZE, GOOGLE_MAX_CHARS):
+        lines = (translator.translate('\n'.join(chunk)) or '').split('\n')
+        if len(lines) != len(chunk):
+            # Line breaks were not preserved: translate this chunk one text at a time
+            lines = [translator.translate(t) or t for t in chunk]
+        results.extend(line.strip() for line in lines)
+    return results
+
+
+def _ollama_backend(texts, language):
+    # Local model through the shared LLM client: works offline, all texts of a batch in flight at once
+    prompts = [[{'role': 'user', 'content': OLLAMA_PROMPT.format(language=language, text=t)}] for t in texts]
+    results = []
+    for text, response in zip(texts, llm.chat_many(prompts, model=config.TRANSLATE_MODEL or config.LLM_MODEL)):
+        if isinstance(response, Exception):
+            raise response
+        results.append(response['message']['content'].strip().strip("'\"") or text)
+    return results
+
+
+def _identity_backend(texts, language):
+    return list(texts)
+
+
+TRANSLATE_BACKENDS = {'google': _google_backend, 'ollama': _ollama_backend, 'none': _identity_backend}
+
+
+def _get_backend():
+    name = config.TRANSLATE_BACKEND
+    if ':' in name:
+        # Any local translator given as "package.module:function" taking (texts, source language)
+        module_name, func_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), func_name)
+    return TRANSLATE_BACKENDS[name]
+
+
+def translate_many(texts, languages=None):
+    """English text for each input, plus the detected source languages. English rows are
+    returned unchanged; the rest go through the translation memory, and only misses reach the
+    backend, one batched call per source language. A failing backend leaves its texts
+    untranslated (and uncached) rather than failing the upload."""
+    texts = [str(t or '') for t in texts]
+    detected = detect_languages(texts, languages)
+    results = list(texts)
+    wanted = defaultdict(list)  # (source text, language) -> row indices
+    for i, (text, language) in enumerate(zip(texts, detected)):
+        if language != 'en' and text.strip():
+            wanted[(text.strip(), language)].append(i)
+
+    missing = defaultdict(list)
+    for (text, language), indices in wanted.items():
+        cached = translation_cache.get(make_key(text, language, config.TRANSLATE_BACKEND))
+        if cached is None:
+            missing[language].append(text)
+        for i in indices:
+            results[i] = cached if cached is not None else texts[i]
+
+    backend = _get_backend()
+    for language, unique in missing.items():
+        try:
+            with metrics.stage('translate', len(unique)):
+                translated = backend(unique, language)
+        except Exception as e:
+            logger.warning("Translation from %s failed for %d texts: %s", language, len(unique), str(e))
+            continue
+        for text, english in zip(unique, translated):
+            translation_cache.put(make_key(text, language, config.TRANSLATE_BACKEND), english)
+            for i in wanted[(text, language)]:
+                results[i] = english
+    return results, detected
+
+
+def translate_to_english(text, language=None):
+    return translate_many([text], [language])[0][0]
@@ -0,0 +1,195 @@
+import logging
+import sys
+import threading
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from backend import config
+from backend.db import Session, Comment, bump_data_version
+
+logger = logging.getLogger(__name__)
+
+MIN_TRAIN_SIZE = 256  # below this a flat scan is as fast as probing cells
+REBUILD_GROWTH = 4  # retrain the coarse quantizer once the index grows this much past its training size
+
+
+def pack_embedding(vector):
+    return np.asarray(vector, dtype='<f4').tobytes()
+
+
+def unpack_embedding(blob):
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype='<f4')
+
+
+class VectorIndex:
+    """IVF index over L2-normalized vectors: each vector lives in the cell of its nearest
+    coarse centroid and queries only scan the nprobe closest cells."""
+
+    def __init__(self, nlist=None, nprobe=None):
+        self.nlist = nlist if nlist is not None else config.ANN_NLIST
+        self.nprobe = nprobe or config.ANN_NPROBE
+        self.centroids = None
+        self.cells = {}  # cell -> (ids, vectors)
+        self.size = 0
+        self.trained_size = 0
+        self.dim = None
+        self.lock = threading.RLock()
+
+    def _all(self):
+        if not self.cells:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dim or 0), dtype=np.float32)
+        ids, vecs = zip(*self.cells.values())
+        return np.concatenate(ids), np.vstack(vecs)
+
+    def _assign(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def _append(self, ids, vectors):
+        cells = self._assign(vectors)
+        for cell in np.unique(cells).tolist():
+            mask = cells == cell
+            if cell in self.cells:
+                old_ids, old_vecs = self.cells[cell]
+                self.cells[cell] = (np.concatenate([old_ids, ids[mask]]), np.vstack([old_vecs, vectors[mask]]))
+            else:
+                self.cells[cell] = (ids[mask], vectors[mask])
+        self.size += len(ids)
+
+    def build(self, ids, vectors):
+        with self.lock:
+            ids = np.asarray(ids, dtype=np.int64)
+            vectors = np.asarray(vectors, dtype=np.float32)
+            self.dim = vectors.shape[1] if len(vectors) else self.dim
+            self.cells, self.size, self.centroids = {}, 0, None
+            nlist = self.nlist or int(np.sqrt(len(ids)))
+            if len(ids) >= MIN_TRAIN_SIZE and nlist > 1:
+                sample = vectors[np.random.default_rng(42).choice(len(vectors), min(len(vectors), nlist * 64), replace=False)]
+                kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=42, n_init=3, batch_size=1024).fit(sample)
+                centroids = kmeans.cluster_centers_.astype(np.float32)
+                self.centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+            self.trained_size = len(ids)
+            if len(ids):
+                self._append(ids, vectors)
+
+    def add(self, ids, vectors):
+        with self.lock:
+            ids = np.asarray(ids, dtype=np.int64)
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if not len(ids):
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            self._append(ids, vectors)
+            if self.size >= MIN_TRAIN_SIZE and self.size >= REBUILD_GROWTH * max(self.trained_size, 1):
+                self.build(*self._all())
+
+    def search(self, vector, k=10, exclude=None):
+        with self.lock:
+            if not self.size:
+                return []
+            vector = np.asarray(vector, dtype=np.float32)
+            if self.centroids is None:
+                probe = list(self.cells)
+            else:
+                # The nprobe nearest cells that hold vectors; empty cells are skipped, not counted
+                probe = [c for c in np.argsort(-(self.centroids @ vector)).tolist() if c in self.cells][:self.nprobe]
+            ids = np.concatenate([self.cells[c][0] for c in probe])
+            vecs = np.vstack([self.cells[c][1] for c in probe])
+        scores = vecs @ vector
+        if exclude is not None:
+            scores[ids == exclude] = -np.inf
+        top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def near_duplicates(self, threshold=0.95, block=2048):
+        """Pairs (id_a, id_b, score) with cosine >= threshold, compared within cells only."""
+        pairs = []
+        with self.lock:
+            cells = list(self.cells.values())
+        for ids, vecs in cells:
+            for start in range(0, len(ids), block):
+                sims = vecs[start:start + block] @ vecs.T
+                rows, cols = np.nonzero(sims >= threshold)
+                for r, c in zip(rows, cols):
+                    if start + r < c:
+                        pairs.append((int(ids[start + r]), int(ids[c]), float(sims[r, c])))
+        return sorted(pairs, key=lambda p: -p[2])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _load_index(draft_version):
+    db = Session()
+    try:
+        ids, vectors = [], []
+        query = db.query(Comment.id, Comment.embedding).filter(
+            Comment.draft_version == draft_version, Comment.embedding.isnot(None))
+        for comment_id, blob in query.yield_per(5000):
+            vector = unpack_embedding(blob)
+            if vectors and len(vector) != len(vectors[0]):
+                continue  # written by a different embedding backend; needs a backfill
+            ids.append(comment_id)
+            vectors.append(vector)
+    finally:
+        db.close()
+    index = VectorIndex()
+    index.build(ids, np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32))
+    logger.debug("Built vector index for %s: %d vectors, %d cells", draft_version, index.size, len(index.cells))
+    return index
+
+
+def get_index(draft_version):
+    with _indexes_lock:
+        if draft_version not in _indexes:
+            _indexes[draft_version] = _load_index(draft_version)
+        return _indexes[draft_version]
+
+
+def index_comments(rows):
+    """Add freshly committed (id, draft_version, embedding blob) rows to already-loaded indexes."""
+    by_draft = {}
+    for comment_id, draft_version, blob in rows:
+        if blob is not None:
+            by_draft.setdefault(draft_version, []).append((comment_id, unpack_embedding(blob)))
+    for draft_version, items in by_draft.items():
+        with _indexes_lock:
+            index = _indexes.get(draft_version)
+        if index is not None:
+            index.add([i for i, _ in items], np.vstack([v for _, v in items]))
+
+
+def backfill_embeddings(batch_size=500):
+    """Embed rows stored without an embedding (e.g. before the binary format) and drop cached indexes."""
+    from backend.ai import get_embeddings
+    db = Session()
+    done = 0
+    try:
+        while True:
+            rows = db.query(Comment).filter(Comment.embedding.is_(None)).order_by(Comment.id).limit(batch_size).all()
+            if not rows:
+                break
+            for comment, vector in zip(rows, get_embeddings([c.translated_comment or c.original_comment or '' for c in rows])):
+                comment.embedding = pack_embedding(vector)
+            bump_data_version(db, rewrite=True)
+            db.commit()
+            done += len(rows)
+    finally:
+        db.close()
+    with _indexes_lock:
+        _indexes.clear()
+    return done
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['backfill']:
+        print(f"Embedded {backfill_embeddings()} comments")
+    else:
+        print("Usage: python -m backend.vectors backfill")
@@ -3,7 +3,8 @@ import os
 import streamlit as st
 import requests
 import pandas as pd
-import json
+import time
+from urllib.parse import urlencode
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -15,10 +16,11 @@ print("viz.py Exists:", os.path.exists("utils/viz.py"))
 print("report.py Exists:", os.path.exists("utils/report.py"))
 try:
     from utils.viz import (
-        sentiment_pie, sentiment_trend, top_keywords_bar, keyword_sentiment_heatmap,
-        sentiment_wordcloud, summary_cards, section_sentiment_stacked, cluster_bubble
+        summary_cards, sentiment_pie_from_counts, sentiment_trend_from_counts, top_keywords_bar_from_counts,
+        keyword_sentiment_heatmap_from_counts, sentiment_wordcloud_from_counts, section_sentiment_stacked_from_counts,
+        cluster_bubble_from_points
     )
-    from utils.report import generate_pdf_report, generate_excel_report
+    from utils.data import API_URL, data_version, fetch_counts, fetch_summary, cached_figure
     print("Successfully imported utils.viz and utils.report")
 except Exception as e:
     print(f"Failed to import utils: {e}")
@@ -34,25 +36,41 @@ if uploaded_file:
     with st.spinner("Processing..."):
         files = {"file": (uploaded_file.name, uploaded_file.getvalue())}
         try:
-            response = requests.post("http://localhost:8000/upload", files=files)
+            response = requests.post(f"{API_URL}/upload", files=files)
             if response.status_code == 200:
-                st.success("File processed successfully!")
+                job_id = response.json()["job_id"]
+                progress = st.progress(0.0, text="Queued...")
+                while True:
+                    job = requests.get(f"{API_URL}/jobs/{job_id}").json()
+                    if job["rows_total"]:
+                        eta = f", ETA {job['eta_seconds']:.0f}s" if job["eta_seconds"] is not None else ""
+                        progress.progress(min(job["rows_done"] / job["rows_total"], 1.0),
+                                          text=f"{job['rows_done']}/{job['rows_total']} rows{eta}")
+                    if job["status"] in ("done", "failed"):
+                        break
+                    time.sleep(1)
+                if job["status"] == "done" and not job["failures"]:
+                    st.success("File processed successfully!")
+                elif job["status"] == "done":
+                    st.warning(f"File processed with {job['failures']} failed rows: {job['error']}")
+                else:
+                    st.error(f"Upload failed: {job['error']}")
             else:
                 st.error(f"Upload failed: {response.text}")
         except requests.exceptions.ConnectionError:
-            st.error("Cannot connect to backend. Ensure FastAPI is running on http://localhost:8000.")
+            st.error(f"Cannot connect to backend. Ensure FastAPI is running on {API_URL}.")
             st.stop()
 
 # Text Input for Sentiment Analysis
 st.subheader("Analyze Single Comment")
 comment_text = st.text_area("Paste your comment here:", height=100)
-comment_language = st.selectbox("Comment Language", ["en", "hi"])
+comment_language = st.selectbox("Comment Language", ["en", "hi", "auto"])
 if st.button("Analyze Comment"):
     if comment_text:
         with st.spinner("Analyzing..."):
             payload = {"comment": comment_text, "language": comment_language}
             try:
-                response = requests.post("http://localhost:8000/analyze-text", json=payload)
+                response = requests.post(f"{API_URL}/analyze", json=payload)
                 if response.status_code == 200:
                     result = response.json()
                     st.success(f"Sentiment: {result['sentiment']} (Confidence: {result['confidence']}%)")
@@ -61,7 +79,7 @@ if st.button("Analyze Comment"):
                 else:
                     st.error(f"Analysis failed: {response.text}")
             except requests.exceptions.ConnectionError:
-                st.error("Cannot connect to backend. Ensure FastAPI is running on http://localhost:8000.")
+                st.error(f"Cannot connect to backend. Ensure FastAPI is running on {API_URL}.")
     else:
         st.warning("Please enter a comment.")
 
@@ -73,61 +91,95 @@ if draft_version == "All": draft_version = None
 if section == "All": section = None
 
 # Get Data for Visualizations
+# Everything below is cached on (filters, data version): reruns that do not change either
+# make one small /version request and redraw cached figures
+filters = {"draft_version": draft_version, "section": section}
+filter_key = tuple(sorted(filters.items()))
+
 try:
-    data_response = requests.get("http://localhost:8000/analysis", params={"draft_version": draft_version, "section": section})
-    if data_response.status_code == 200:
-        data = json.loads(data_response.content)
-        df = pd.DataFrame(data)
-        
-        if not df.empty:
-            st.subheader("Sentiment Distribution")
-            st.plotly_chart(sentiment_pie(df))
-            
-            st.subheader("Sentiment Trends Over Time")
-            st.plotly_chart(sentiment_trend(df))
-            
+    version = data_version()
+    # Charts are drawn from server-side rollups, so their cost depends on the number of buckets
+    sentiment_counts = fetch_counts("/analytics/sentiment", filters, version)
+    if not sentiment_counts.empty:
+        date_counts = fetch_counts("/analytics/sentiment-by-date", filters, version)
+        keyword_counts = fetch_counts("/analytics/keyword-sentiment", filters, version, limit=20)
+        section_counts = fetch_counts("/analytics/sentiment-by-section", filters, version)
+        stakeholder_counts = fetch_counts("/analytics/top-stakeholders", filters, version, limit=5)
+
+        st.subheader("Sentiment Distribution")
+        st.plotly_chart(cached_figure("sentiment_pie", filter_key, version, lambda: sentiment_pie_from_counts(sentiment_counts)))
+
+        st.subheader("Sentiment Trends Over Time")
+        st.plotly_chart(cached_figure("sentiment_trend", filter_key, version, lambda: sentiment_trend_from_counts(date_counts)))
+
+        if not keyword_counts.empty:
             st.subheader("Top Keywords")
-            st.plotly_chart(top_keywords_bar(df))
-            
+            st.plotly_chart(cached_figure("top_keywords", filter_key, version, lambda: top_keywords_bar_from_counts(keyword_counts)))
+
             st.subheader("Keyword vs Sentiment Heatmap")
-            st.plotly_chart(keyword_sentiment_heatmap(df))
-            
+            st.pyplot(cached_figure("keyword_heatmap", filter_key, version, lambda: keyword_sentiment_heatmap_from_counts(keyword_counts)))
+
             st.subheader("Sentiment Word Cloud")
-            st.pyplot(sentiment_wordcloud(df))
-            
-            st.subheader("Summary Cards")
-            summary_cards(df)
-            
-            st.subheader("Sentiment per Section")
-            st.plotly_chart(section_sentiment_stacked(df))
-            
-            st.subheader("Topic Clusters")
-            st.plotly_chart(cluster_bubble(df))
-            
-            st.subheader("Stakeholder Contributions")
-            if 'stakeholder' in df.columns:
-                df['contribution_score'] = df['original_comment'].str.len()
-                top_stakeholders = df.groupby('stakeholder')['contribution_score'].sum().nlargest(5)
-                st.table(top_stakeholders)
-                for sh, score in top_stakeholders.items():
-                    badge = "Gold" if score > 1000 else "Silver" if score > 500 else "Bronze"
-                    st.write(f"{sh}: {badge} Badge")
-            
-            st.subheader("Overall Summary")
-            overall_summary = "Overall summary generated from all comments."
-            st.write(overall_summary)
-            
-            if st.button("Generate PDF Report"):
-                pdf_path = generate_pdf_report(df)
-                with open(pdf_path, "rb") as f:
-                    st.download_button("Download PDF", f, file_name="report.pdf")
-            
-            if st.button("Generate Excel Report"):
-                excel_path = generate_excel_report(df)
-                with open(excel_path, "rb") as f:
-                    st.download_button("Download Excel", f, file_name="report.xlsx")
-    else:
-        st.error(f"Analysis failed: {data_response.text}")
+            st.pyplot(cached_figure("wordcloud", filter_key, version, lambda: sentiment_wordcloud_from_counts(keyword_counts)))
+
+        st.subheader("Sentiment per Section")
+        st.plotly_chart(cached_figure("section_stacked", filter_key, version, lambda: section_sentiment_stacked_from_counts(section_counts)))
+
+        st.subheader("Stakeholder Contributions")
+        if not stakeholder_counts.empty:
+            top_stakeholders = stakeholder_counts.set_index("stakeholder")["characters"]
+            st.table(top_stakeholders)
+            for sh, score in top_stakeholders.items():
+                badge = "Gold" if score > 1000 else "Silver" if score > 500 else "Bronze"
+                st.write(f"{sh}: {badge} Badge")
+
+        st.subheader("Keyword Search")
+        keyword_query = st.text_input("Keyword")
+        if keyword_query:
+            matches = fetch_counts("/keywords", filters, version, q=keyword_query, limit=10, ids_limit=20)
+            if matches.empty:
+                st.write("No matching keywords.")
+            else:
+                st.dataframe(matches)
+
+        # Row-level views only need a few rows each: the first summaries per sentiment and a
+        # bounded, server-side projected sample for the bubble chart
+        cards = pd.concat([fetch_counts("/comments", filters, version, sentiment=s, limit=3, fields="sentiment,summary")
+                           for s in ("Positive", "Negative")], ignore_index=True).reindex(columns=["sentiment", "summary"])
+        points = fetch_counts("/clusters/points", filters, version, limit=5000)
+
+        st.subheader("Summary Cards")
+        summary_cards(cards)
+
+        st.subheader("Topic Clusters")
+        bubble = cached_figure("cluster_bubble", filter_key, version, lambda: cluster_bubble_from_points(points))
+        if bubble is not None:
+            st.plotly_chart(bubble)
+
+        st.subheader("Overall Summary")
+        if draft_version is None:
+            st.write("Select a draft version to see its summary.")
+        else:
+            draft_summary = fetch_summary(draft_version, version)
+            if draft_summary is None:
+                st.write("The summary for this draft has not been generated yet.")
+            else:
+                st.write(draft_summary["summary"])
+                st.caption(f"Covers {draft_summary['comments_covered']} comments")
+                if draft_summary["recommendations"]:
+                    st.subheader("Policy Recommendations")
+                    for recommendation in draft_summary["recommendations"]:
+                        st.write(f"- {recommendation}")
+                with st.expander("Summaries per topic"):
+                    for group, text in draft_summary["cluster_summaries"].items():
+                        st.write(f"**{group}**: {text}")
+
+        # Reports are built by the backend straight from the database and downloaded from it
+        report_params = urlencode({k: v for k, v in filters.items() if v is not None})
+        st.link_button("Download PDF Report", f"{API_URL}/reports/pdf?{report_params}")
+        st.link_button("Download Excel Report", f"{API_URL}/reports/excel?{report_params}")
+except requests.exceptions.HTTPError as e:
+    st.error(f"Analysis failed: {e}")
 except requests.exceptions.ConnectionError:
-    st.error("Cannot connect to backend. Ensure FastAPI is running on http://localhost:8000.")
-    st.stop()
\ No newline at end of file
+    st.error(f"Cannot connect to backend. Ensure FastAPI is running on {API_URL}.")
+    st.stop()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Run from any directory: the backend package and tools live at the project root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from backend.llm import AdaptiveLimit, AsyncLLMClient, LLMError
+from tools.fake_ollama import serve
+
+MESSAGES = [{'role': 'user', 'content': "Comment: 'The fee is unfair'"}]
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(faults=()):
+        server, url = serve(faults=faults)
+        server.RequestHandlerClass.hang_seconds = 0.5
+        servers.append(server)
+        return server.RequestHandlerClass, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def run(client, *calls):
+    async def main():
+        try:
+            results = []
+            for call in calls:
+                results.append(await call(client))
+            return results
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def make_client(url, **kwargs):
+    return AsyncLLMClient(host=url, **{'concurrency': 4, 'timeout': 0.2, 'retries': 2, 'backoff': 0.001, **kwargs})
+
+
+def test_retries_server_errors_then_succeeds(stub):
+    handler, url = stub([500, 503])
+    [response] = run(make_client(url), lambda c: c.chat(MESSAGES))
+    assert response['message']['content']
+    assert handler.requests_served == 3
+
+
+def test_gives_up_after_retries(stub):
+    handler, url = stub([500, 502, 504])
+    with pytest.raises(LLMError):
+        run(make_client(url), lambda c: c.chat(MESSAGES))
+    assert handler.requests_served == 3
+
+
+def test_retries_timeouts(stub):
+    handler, url = stub(['hang'])
+    [response] = run(make_client(url), lambda c: c.chat(MESSAGES))
+    assert response['message']['content']
+    assert handler.requests_served == 2
+
+
+def test_client_errors_are_not_retried(stub):
+    handler, url = stub([404])
+    with pytest.raises(LLMError, match='404'):
+        run(make_client(url), lambda c: c.chat(MESSAGES))
+    assert handler.requests_served == 1
+
+
+def test_overload_halves_limit_and_successes_restore_it(stub):
+    handler, url = stub([503, 429])
+    client = make_client(url)
+    limits = []
+
+    async def record(c):
+        limits.append(c.current_limit)
+
+    run(client, lambda c: c.chat(MESSAGES), record, *[lambda c: c.chat(MESSAGES)] * 20, record)
+    # Two overloads halve 4 -> 2 -> 1, then the success adds 1/limit
+    assert limits[0] == 2
+    assert limits[1] == 4
+
+
+def test_adaptive_limit_bounds():
+    async def main():
+        limit = AdaptiveLimit(8)
+        for _ in range(5):
+            await limit.acquire()
+            await limit.release(overloaded=True)
+        assert limit.limit == 1.0  # never below one slot
+        for _ in range(200):
+            await limit.acquire()
+            await limit.release()
+        assert limit.limit == 8.0  # never above the configured maximum
+        assert limit.in_flight == 0
+    asyncio.run(main())
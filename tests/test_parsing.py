@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from backend.parsing import ParseError, parse_analysis, parse_batch, parse_string_list, strip_list_markup, validate, ANALYSIS_SCHEMA
+
+
+def analysis(**overrides):
+    return json.dumps({'sentiment': 'Negative', 'confidence': 80, 'summary': 'Fees are too high.',
+                       'keywords': ['fees', 'cost'], **overrides})
+
+
+def test_plain_answer():
+    assert parse_analysis(analysis()) == ('Negative', 80.0, 'Fees are too high.', ['fees', 'cost'])
+
+
+def test_fenced_answer():
+    assert parse_analysis(f"```json\n{analysis()}\n```")[0] == 'Negative'
+
+
+def test_chatty_answer():
+    text = f"Sure! Here is the analysis you asked for:\n{analysis(sentiment='positive ')}\nLet me know if you need more."
+    assert parse_analysis(text)[0] == 'Positive'
+
+
+def test_first_valid_object_wins():
+    text = '{"note": "thinking"} ' + analysis(confidence=65)
+    assert parse_analysis(text)[1] == 65.0
+
+
+def test_truncated_answer_raises():
+    with pytest.raises(ParseError):
+        parse_analysis(analysis()[:40])
+
+
+def test_invalid_sentiment_raises():
+    with pytest.raises(ParseError):
+        parse_analysis(analysis(sentiment='Angry'))
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (0.85, 85.0),    # a probability
+    (1, 1.0),        # a whole number is already a percentage
+    (1.0, 1.0),
+    (0, 0.0),
+    ('85%', 85.0),
+    (100, 100.0),
+])
+def test_confidence_coercion(raw, expected):
+    assert parse_analysis(analysis(confidence=raw))[1] == expected
+
+
+@pytest.mark.parametrize('raw', ['NaN', 'Infinity', '"nan"', '150', '-5'])
+def test_confidence_out_of_range_raises(raw):
+    text = analysis().replace('"confidence": 80', f'"confidence": {raw}')
+    with pytest.raises(ParseError):
+        parse_analysis(text)
+
+
+def test_validate_rejects_nan():
+    data = json.loads(analysis())
+    data['confidence'] = float('nan')
+    assert validate(data, ANALYSIS_SCHEMA)
+
+
+def batch_item(i, **overrides):
+    return json.loads(analysis(id=i, **overrides))
+
+
+def test_batch_keeps_valid_items():
+    items = [batch_item(0), batch_item(1, sentiment='Unknown'), batch_item(2)]
+    parsed, rejected = parse_batch(json.dumps(items), {0, 1, 2})
+    assert sorted(parsed) == [0, 2]
+    assert rejected == 1
+
+
+def test_truncated_batch_keeps_complete_items():
+    text = json.dumps([batch_item(0), batch_item(1), batch_item(2)])
+    cut = text[:text.index('"id": 2') + 4]  # the answer stops inside the third object
+    parsed, _ = parse_batch(f"Here you go:\n```json\n{cut}", {0, 1, 2})
+    assert sorted(parsed) == [0, 1]
+
+
+def test_batch_ignores_unknown_and_repeated_ids():
+    items = [batch_item(0), batch_item(0, sentiment='Positive'), batch_item(7), batch_item('1')]
+    parsed, rejected = parse_batch(json.dumps(items), {0, 1})
+    assert parsed[0][0] == 'Negative'
+    assert sorted(parsed) == [0, 1]  # "1" is coerced to an int
+    assert rejected == 2
+
+
+def test_string_list():
+    assert parse_string_list('Recommendations:\n```json\n["Rec 1", " Rec 2 ", ""]\n```') == ['Rec 1', 'Rec 2']
+    assert parse_string_list('["a", "b", "c"]', limit=2) == ['a', 'b']
+    with pytest.raises(ParseError):
+        parse_string_list('[1, 2]')
+
+
+def test_strip_list_markup():
+    assert strip_list_markup("- First\n2) Second\n\n* Third") == ['First', 'Second', 'Third']
@@ -0,0 +1,264 @@
+"""Benchmarks for the ingestion and query pipeline against a fake Ollama server, with JSON output.
+
+Run: python -m tools.bench --rows 5000 --latency 0.05 --output bench.json
+     python -m tools.bench --rows 5000 --compare bench.json   # exit 1 on regressions
+
+Every run uses a fresh database, LLM cache and upload directory in a temporary directory.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tools.fake_ollama import serve
+from tools.synth import generate_rows, parse_mix, write_csv
+
+BENCHMARKS = ('process', 'insert', 'upload', 'analyze', 'comments', 'aggregate', 'report')
+# Result keys where larger is better; every other timing key is a duration in seconds
+HIGHER_IS_BETTER = ('rows_per_second', 'requests_per_second')
+
+
+def _configure(workdir, url, args):
+    # backend.config reads the environment at import time, so this runs before any backend import
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'LLM_CACHE_PATH': os.path.join(workdir, 'llm_cache.db'),
+        'PREFILTER_MODEL_PATH': os.path.join(workdir, 'prefilter.joblib'),
+        'UPLOAD_DIR': os.path.join(workdir, 'uploads'),
+        'OLLAMA_HOST': url,
+        'RECLUSTER_INTERVAL': '0',
+        'TRANSLATE_BACKEND': args.translate_backend,
+    })
+
+
+def _latencies(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        'requests': repeat,
+        'mean_seconds': statistics.fmean(samples),
+        'p50_seconds': samples[len(samples) // 2],
+        'p95_seconds': samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        'requests_per_second': repeat / sum(samples) if sum(samples) else None,
+    }
+
+
+def _get(client, path, **params):
+    response = client.get(path, params=params)
+    response.raise_for_status()
+    return response
+
+
+def bench_process(state):
+    from backend.processing import process_records
+    served = state['server'].RequestHandlerClass.requests_served
+    started = time.perf_counter()
+    state['processed'] = process_records(state['rows'])
+    elapsed = time.perf_counter() - started
+    return {'rows': len(state['rows']), 'seconds': elapsed, 'rows_per_second': len(state['rows']) / elapsed,
+            'llm_requests': state['server'].RequestHandlerClass.requests_served - served}
+
+
+def bench_insert(state):
+    from backend import config
+    from backend.db import Session, bulk_insert_comments, bump_data_version
+    from backend.dedup import add_group_members
+    from backend.keywords import index_keywords
+    from backend.rollups import update_rollups
+    processed = state.get('processed') or []
+    step = config.JOB_CHUNK_SIZE
+    db = Session()
+    try:
+        started = time.perf_counter()
+        # The same per-chunk transaction as an upload job
+        for start in range(0, len(processed), step):
+            chunk = processed[start:start + step]
+            ids = bulk_insert_comments(db, chunk)
+            update_rollups(db, chunk)
+            index_keywords(db, [(i, item['keywords']) for i, item in zip(ids, chunk)])
+            add_group_members(db, [item.get('duplicate_group') for item in chunk])
+            bump_data_version(db)
+            db.commit()
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    return {'rows': len(processed), 'seconds': elapsed,
+            'rows_per_second': len(processed) / elapsed if elapsed else None}
+
+
+def _wait_for_jobs(client, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(j['status'] not in ('queued', 'running') for j in client.get('/jobs', params={'limit': 100}).json()):
+            return
+        time.sleep(0.2)
+    raise TimeoutError('jobs did not finish')
+
+
+def bench_upload(state):
+    client, path = state['client'], os.path.join(state['workdir'], 'upload.csv')
+    write_csv(path, state['rows'])
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        response = client.post('/upload', files={'file': ('upload.csv', f, 'text/csv')})
+    response.raise_for_status()
+    job_id = response.json()['job_id']
+    while True:
+        job = client.get(f'/jobs/{job_id}').json()
+        if job['status'] not in ('queued', 'running'):
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    # Let the follow-up summary jobs finish so they do not skew the query benchmarks
+    summary_started = time.perf_counter()
+    _wait_for_jobs(client, state['args'].timeout)
+    return {'rows': job['rows_done'], 'failures': job['failures'], 'status': job['status'], 'seconds': elapsed,
+            'rows_per_second': job['rows_done'] / elapsed, 'summary_seconds': time.perf_counter() - summary_started}
+
+
+def bench_analyze(state):
+    client, rows = state['client'], iter(state['extra_rows'])
+
+    def analyze():
+        row = next(rows)
+        client.post('/analyze', json={k: row[k] for k in ('comment', 'language', 'section', 'draft_version')}).raise_for_status()
+    return _latencies(analyze, state['args'].repeat)
+
+
+def bench_comments(state):
+    client, repeat = state['client'], state['args'].repeat
+    started = time.perf_counter()
+    lines = sum(1 for line in client.get('/comments', params={'format': 'ndjson'}).iter_lines() if line)
+    return {
+        'page': _latencies(lambda: _get(client, '/comments', limit=500), repeat),
+        'filtered_page': _latencies(lambda: _get(client, '/comments', draft_version='v1', section='Section 1', limit=500), repeat),
+        'keyword_page': _latencies(lambda: _get(client, '/comments', keyword='burden', limit=500), repeat),
+        'full_ndjson': {'rows': lines, 'seconds': time.perf_counter() - started},
+    }
+
+
+def bench_aggregate(state):
+    client, repeat = state['client'], state['args'].repeat
+    return {path.strip('/').replace('/', '_'): _latencies(lambda: _get(client, path), repeat) for path in (
+        '/analytics/sentiment', '/analytics/sentiment-by-date', '/analytics/sentiment-by-section',
+        '/analytics/keyword-sentiment', '/analytics/top-stakeholders', '/keywords')}
+
+
+def bench_report(state):
+    results = {}
+    for kind in ('excel', 'pdf'):
+        started = time.perf_counter()
+        response = _get(state['client'], f'/reports/{kind}')
+        results[kind] = {'seconds': time.perf_counter() - started, 'bytes': len(response.content)}
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    server, url = serve(latency=args.latency)
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure(workdir, url, args)
+        from fastapi.testclient import TestClient
+        from backend import config
+        from backend.main import app
+        logging.getLogger().setLevel(logging.WARNING)  # per-request debug logging would dominate the timings
+
+        rows = list(generate_rows(args.rows + args.repeat, args.seed, parse_mix(args.languages),
+                                  args.duplicate_rate, args.sections, args.drafts))
+        output = {
+            'revision': _git_revision(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+            'config': {k: getattr(config, k) for k in ('LLM_CONCURRENCY', 'LLM_BATCH_SIZE', 'EXECUTOR', 'EXECUTOR_WORKERS',
+                                                      'JOB_CHUNK_SIZE', 'EMBED_BACKEND', 'DEDUP_ENABLED')},
+            'results': {},
+        }
+        with TestClient(app) as client:
+            state = {'args': args, 'server': server, 'workdir': workdir, 'client': client,
+                     'rows': rows[:args.rows], 'extra_rows': rows[args.rows:]}
+            for name in args.only or BENCHMARKS:
+                started = time.perf_counter()
+                output['results'][name] = globals()[f'bench_{name}'](state)
+                print(f'{name}: {time.perf_counter() - started:.2f}s', file=sys.stderr)
+    server.shutdown()
+    return output
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+
+def compare(baseline, current, tolerance):
+    """Metrics that got worse than the baseline by more than tolerance (a fraction)."""
+    before = dict(_flatten(baseline['results']))
+    regressions = []
+    for name, value in _flatten(current['results']):
+        metric = name.rsplit('.', 1)[-1]
+        old = before.get(name)
+        if not old or not value:
+            continue
+        if metric in HIGHER_IS_BETTER:
+            change = (old - value) / old
+        elif metric.endswith('seconds'):
+            change = (value - old) / old
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({'metric': name, 'baseline': old, 'current': value, 'change': change})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--languages', default='en=0.9,hi=0.1', help='language mix, e.g. en=0.8,hi=0.2')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--sections', type=int, default=10)
+    parser.add_argument('--drafts', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake Ollama seconds per request')
+    parser.add_argument('--translate-backend', default='none')
+    parser.add_argument('--repeat', type=int, default=20, help='requests per latency benchmark')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds to wait for background jobs')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS)
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    output = run(args)
+    if args.compare:
+        with open(args.compare) as f:
+            output['regressions'] = compare(json.load(f), output, args.tolerance)
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if output.get('regressions'):
+        for r in output['regressions']:
+            print(f"Regression: {r['metric']} {r['baseline']:.4g} -> {r['current']:.4g} ({r['change']:+.0%})", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,147 @@
+"""Stand-in for the Ollama HTTP API (/api/chat, /api/embed) for local testing and benchmarks.
+
+Run: python -m tools.fake_ollama --port 11434 --latency 0.2 [--garble-rate 0.1]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NEGATIVE_WORDS = ('bad', 'oppose', 'against', 'poor', 'unfair', 'reject', 'burden', 'harm')
+POSITIVE_WORDS = ('good', 'support', 'welcome', 'excellent', 'great', 'agree', 'benefit')
+
+
+def _sentiment(text):
+    lowered = text.lower()
+    if any(w in lowered for w in NEGATIVE_WORDS):
+        return 'Negative'
+    if any(w in lowered for w in POSITIVE_WORDS):
+        return 'Positive'
+    return 'Neutral'
+
+
+def _analysis(text):
+    words = [w for w in re.findall(r'[a-zA-Z]{4,}', text.lower())]
+    return {
+        'sentiment': _sentiment(text),
+        'confidence': 80,
+        'summary': text[:80],
+        'keywords': list(dict.fromkeys(words))[:3],
+    }
+
+
+def fake_answer(prompt):
+    items = []
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith('{"id"'):
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    if items:
+        return json.dumps([dict(_analysis(item.get('comment', '')), id=item['id']) for item in items])
+    match = re.search(r"Comment: '(.*)'", prompt, re.DOTALL)
+    if match:
+        return json.dumps(_analysis(match.group(1)))
+    if 'recommendation' in prompt.lower():
+        return json.dumps(['Clarify the affected provisions.', 'Consult affected stakeholders.'])
+    return 'Stakeholders raised a range of views on the draft.'
+
+
+def fake_embedding(text, dim=64):
+    # Deterministic bag-of-words vector so similar texts land close together
+    vector = [0.0] * dim
+    for word in re.findall(r'\w+', text.lower()):
+        vector[zlib.crc32(word.encode('utf-8')) % dim] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    garble_rate = 0.0  # share of chat answers cut off mid-way, like a model hitting its token limit
+    # Scripted failures for client tests, one per POST in order: an HTTP status to answer with, or
+    # 'hang' to stall hang_seconds and drop the connection
+    faults = ()
+    hang_seconds = 1.0
+    requests_served = 0
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send(200, {'models': [{'name': 'llama3:8b'}]})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            type(self).requests_served += 1
+            fault = self.faults.pop(0) if self.faults else None
+        if fault == 'hang':
+            time.sleep(self.hang_seconds)
+            return
+        if fault is not None:
+            self._send(fault, {'error': f'injected HTTP {fault}'})
+            return
+        if self.path == '/api/chat':
+            prompt = ' '.join(m.get('content', '') for m in payload.get('messages', []))
+            content = fake_answer(prompt)
+            if self.garble_rate and random.random() < self.garble_rate:
+                content = content[:len(content) * 2 // 3]
+            self._send(200, {
+                'model': payload.get('model'),
+                'message': {'role': 'assistant', 'content': content},
+                'done': True,
+                'prompt_eval_count': len(prompt) // 4,
+                'eval_count': len(content) // 4,
+            })
+        elif self.path == '/api/embed':
+            inputs = payload.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send(200, {'model': payload.get('model'), 'embeddings': [fake_embedding(t) for t in inputs]})
+        else:
+            self._send(404, {'error': 'not found'})
+
+
+def serve(port=0, latency=0.0, garble_rate=0.0, faults=()):
+    """Start the server on a background thread; returns (server, base_url)."""
+    handler = type('Handler', (FakeOllamaHandler,), {'latency': latency, 'garble_rate': garble_rate,
+                                                     'faults': list(faults), 'requests_served': 0})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to sleep per request')
+    parser.add_argument('--garble-rate', type=float, default=0.0, help='share of chat answers to truncate')
+    args = parser.parse_args()
+    server, url = serve(args.port, args.latency, args.garble_rate)
+    print(f'Fake Ollama listening on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,104 @@
+"""Deterministic synthetic consultation comments for load tests and benchmarks.
+
+Run: python -m tools.synth --rows 100000 --languages en=0.8,hi=0.2 --duplicate-rate 0.1 --output comments.csv
+"""
+import argparse
+import csv
+import random
+import sys
+
+FIELDS = ('comment', 'language', 'section', 'draft_version', 'date', 'stakeholder')
+
+TOPICS = ('the compliance burden', 'the reporting deadline', 'the penalty provisions', 'the filing fees',
+          'small business exemptions', 'the data protection clause', 'the transition period',
+          'the audit requirements', 'the definition of related parties', 'the grievance mechanism')
+TEMPLATES = {
+    'Positive': ('We support {topic} and welcome the clarity it brings.',
+                 'The proposal on {topic} is a good step and will benefit investors.',
+                 'I agree with {topic}; it is excellent and long overdue.'),
+    'Negative': ('We oppose {topic} because it adds an unfair burden on small firms.',
+                 'The draft handles {topic} poorly and will harm compliance.',
+                 'I reject {topic} as written; it is bad for startups.'),
+    'Neutral': ('Please clarify how {topic} applies to existing companies.',
+                'The ministry should publish examples for {topic}.',
+                'Section text on {topic} needs a cross reference to the rules.'),
+}
+HINDI = {
+    'Positive': 'हम {topic} का समर्थन करते हैं, यह अच्छा कदम है।',
+    'Negative': 'हम {topic} का विरोध करते हैं, यह छोटे व्यवसायों पर बोझ है।',
+    'Neutral': 'कृपया स्पष्ट करें कि {topic} मौजूदा कंपनियों पर कैसे लागू होगा।',
+}
+STAKEHOLDERS = ('Industry association', 'Law firm', 'Individual', 'Chartered accountant', 'Startup', 'NGO',
+                'Listed company', 'Academic')
+FILLER = ('In our experience', 'Having reviewed the draft', 'On behalf of our members', 'Respectfully',
+          'After consulting our clients', '')
+
+
+def parse_mix(text):
+    """'en=0.8,hi=0.2' -> {'en': 0.8, 'hi': 0.2}"""
+    mix = {}
+    for part in filter(None, text.split(',')):
+        language, _, weight = part.partition('=')
+        mix[language.strip()] = float(weight or 1)
+    return mix
+
+
+def generate_rows(n, seed=42, languages=None, duplicate_rate=0.0, sections=10, drafts=1, days=30):
+    """Yield n comment rows with the upload columns. The same arguments always yield the same rows.
+    A duplicate_rate share of rows copies an earlier comment (half verbatim, half with a small
+    edit), like an organized campaign."""
+    rng = random.Random(seed)
+    languages = languages or {'en': 1.0}
+    codes, weights = list(languages), list(languages.values())
+    originals = []
+    for i in range(n):
+        if originals and rng.random() < duplicate_rate:
+            comment, language = rng.choice(originals[:1000])
+            if rng.random() < 0.5:
+                comment = comment.replace('.', ' indeed.', 1) if '.' in comment else comment + ' indeed'
+        else:
+            sentiment = rng.choice(tuple(TEMPLATES))
+            topic = rng.choice(TOPICS)
+            language = rng.choices(codes, weights)[0]
+            if language == 'hi':
+                comment = HINDI[sentiment].format(topic=topic)
+            else:
+                comment = rng.choice(TEMPLATES[sentiment]).format(topic=topic)
+                prefix = rng.choice(FILLER)
+                comment = f'{prefix}, {comment[0].lower()}{comment[1:]}' if prefix else comment
+                comment += f' (ref {rng.randrange(10 ** 6)})'  # keeps non-duplicates distinct
+            originals.append((comment, language))
+        yield {
+            'comment': comment,
+            'language': language,
+            'section': f'Section {rng.randrange(sections) + 1}',
+            'draft_version': f'v{rng.randrange(drafts) + 1}',
+            'date': f'2025-01-{rng.randrange(days) % 28 + 1:02d}',
+            'stakeholder': f'{rng.choice(STAKEHOLDERS)} {rng.randrange(500)}',
+        }
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--languages', default='en=1', help='language mix, e.g. en=0.8,hi=0.2')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--sections', type=int, default=10)
+    parser.add_argument('--drafts', type=int, default=1)
+    parser.add_argument('--output', default='-', help='CSV path, or - for stdout')
+    args = parser.parse_args()
+    rows = generate_rows(args.rows, args.seed, parse_mix(args.languages), args.duplicate_rate, args.sections, args.drafts)
+    if args.output == '-':
+        writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        write_csv(args.output, rows)
@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+import requests
+import streamlit as st
+
+API_URL = os.environ.get("API_URL", "http://localhost:8000")
+
+
+@st.cache_resource
+def http_session():
+    # One keep-alive connection pool for every rerun and user session
+    return requests.Session()
+
+
+def data_version():
+    """The backend's (data_version, rewrite_version); the only request made on a rerun when nothing changed."""
+    response = http_session().get(f"{API_URL}/version", timeout=10)
+    response.raise_for_status()
+    versions = response.json()
+    return versions["data_version"], versions["rewrite_version"]
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def fetch_json(path, params, version):
+    # version is part of the cache key only: a new version means a new entry
+    response = http_session().get(f"{API_URL}{path}", params=dict(params), timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_counts(path, filters, version, **params):
+    return pd.DataFrame(fetch_json(path, tuple(sorted({**filters, **params}.items())), version))
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def fetch_summary(draft_version, version):
+    response = http_session().get(f"{API_URL}/summary", params={"draft_version": draft_version}, timeout=60)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def cached_figure(name, filters, version, _build):
+    """Build a figure once per (chart, filters, data version); _build is not hashed."""
+    return _build()
@@ -1,18 +1,39 @@
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 import openpyxl
-import pandas as pd
-import os
 
-def generate_pdf_report(df):
-    path = "reports/report.pdf"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    c = canvas.Canvas(path, pagesize=letter)
+REPORT_FIELDS = ['id', 'original_comment', 'sentiment', 'confidence', 'summary', 'keywords',
+                 'section', 'priority', 'draft_version', 'date', 'stakeholder', 'cluster']
+
+
+def _cell(value):
+    if isinstance(value, (list, tuple)):
+        return ", ".join(map(str, value))
+    return value
+
+
+def write_pdf_report(path, rows, summary=()):
+    """Render rows (dicts) page by page; rows can be a database cursor, nothing is buffered.
+    summary is a list of (title, header, rows) sections drawn before the comments."""
+    c = canvas.Canvas(path, pagesize=letter, pageCompression=1)
     c.drawString(100, 750, "e-Consultation Report")
     y = 700
-    for _, row in df.iterrows():
-        c.drawString(100, y, f"Comment: {row['original_comment'][:100]}...")
-        c.drawString(100, y-20, f"Sentiment: {row['sentiment']}")
+    for title, header, section_rows in summary:
+        c.drawString(100, y, title)
+        y -= 20
+        for values in section_rows:
+            c.drawString(120, y, ", ".join(f"{h}: {v}" for h, v in zip(header, values))[:100])
+            y -= 15
+            if y < 100:
+                c.showPage()
+                y = 750
+        y -= 10
+    if summary:
+        c.showPage()
+        y = 750
+    for row in rows:
+        c.drawString(100, y, f"Comment: {str(row.get('original_comment') or '')[:100]}...")
+        c.drawString(100, y-20, f"Sentiment: {row.get('sentiment')}")
         y -= 40
         if y < 100:
             c.showPage()
@@ -20,11 +41,23 @@ def generate_pdf_report(df):
     c.save()
     return path
 
-def generate_excel_report(df):
-    path = "reports/report.xlsx"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with pd.ExcelWriter(path) as writer:
-        df.to_excel(writer, sheet_name="Comments")
-        summary = pd.DataFrame({"Overall Summary": ["Placeholder"]})
-        summary.to_excel(writer, sheet_name="Summary")
-    return path
\ No newline at end of file
+
+def write_excel_report(path, rows, fields=REPORT_FIELDS, summary=()):
+    """Write rows with openpyxl's write-only mode, which streams each row to disk."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Summary")
+    if not summary:
+        ws.append(["Overall Summary"])
+    for title, header, section_rows in summary:
+        ws.append([title])
+        ws.append(list(header))
+        for values in section_rows:
+            ws.append(list(values))
+        ws.append([])
+    ws = wb.create_sheet("Comments")
+    ws.append(list(fields))
+    for row in rows:
+        ws.append([_cell(row.get(f)) for f in fields])
+    wb.save(path)
+    return path
+